@@ -14,16 +14,32 @@ Features:
 
 from escpos.printer import File
 import cv2
+import numpy as np
 import time
 import asyncio
+import concurrent.futures
 import websockets
-import base64
 import os
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import socket
 import argparse
 import threading
+import atexit
+
+# Production WSGI server (optional, falls back to Flask's threaded server)
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+# uvloop: faster event loop for the WebSocket client (optional)
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
 
 # ✅ gpiozero (NEW)
 from gpiozero import LED, Buzzer
@@ -34,31 +50,44 @@ from gpiozero import LED, Buzzer
 PRINTER_DEVICE = "/dev/usb/lp0"
 CAMERA_INDEX = 0
 CAPTURE_COOLDOWN = 5
-FLUSH_FRAMES = 3
-
-IMAGE_PATH = "capture.jpg"
+DETECT_SCALE = 0.5  # Run face detection on a downscaled frame
+FACE_SCALE_FACTOR = 1.3  # Pyramid step for detectMultiScale (fewer scales than 1.1)
+FACE_MIN_SIZE = 48  # Smallest face to detect, in full-resolution pixels
+HAAR_WINDOW = 24  # haarcascade_frontalface_default's window: nothing smaller is found
+# minSize on the downscaled frame (can't go below the cascade window)
+DETECT_MIN_SIZE = max(HAAR_WINDOW, round(FACE_MIN_SIZE * DETECT_SCALE))
+
+IMAGE_PATH = "capture.jpg"  # Only written with --debug-save
+JPEG_QUALITY = 85
 OUTPUT_FOLDER = "output"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FACE_CASCADE_PATH = os.path.join(BASE_DIR, "haarcascade_frontalface_default.xml")
 
 HTTP_PORT = 5001
+HTTP_THREADS = 4
 
 WS_TIMEOUT = 5
 WS_RETRY_DELAY = 3
 WS_MAX_RETRIES = None  # None = infinite retries
+WS_RECV_TIMEOUT = 30  # wait for the receipt after sending
+WS_SEND_TIMEOUT = 60  # upper bound for one capture's send + receipt
 
 LED_PIN = 24
 BUZZER_PIN = 23
 
+# Camera resolution
+CAMERA_WIDTH = 1280
+CAMERA_HEIGHT = 720
+CAMERA_WARMUP_FRAMES = 5  # Frames dropped after opening while auto-exposure settles
+
 # ==============================
 # GLOBAL STATE
 # ==============================
 capture_triggered = False
+capture_state_lock = threading.Lock()
 last_capture_time = 0
-
-led_buzzer_thread = None
-led_buzzer_stop = threading.Event()
+debug_save = False
 
 app = Flask(__name__)
 
@@ -74,32 +103,23 @@ buzzer.off()
 # ==============================
 # LED & BUZZER CONTROL
 # ==============================
-def led_buzzer_blink(blink_interval=0.5):
-    while not led_buzzer_stop.is_set():
-        led.on()
-        buzzer.on()
-        time.sleep(blink_interval)
-        led.off()
-        buzzer.off()
-        time.sleep(blink_interval)
-
 def start_blinking(blink_interval=0.5):
-    global led_buzzer_thread
-    led_buzzer_stop.clear()
-    led_buzzer_thread = threading.Thread(
-        target=led_buzzer_blink,
-        args=(blink_interval,),
-        daemon=True
-    )
-    led_buzzer_thread.start()
+    # Let gpiozero run the blink pattern itself (off() cancels it)
+    led.blink(on_time=blink_interval, off_time=blink_interval, background=True)
+    buzzer.beep(on_time=blink_interval, off_time=blink_interval, background=True)
 
 def stop_blinking():
-    led_buzzer_stop.set()
-    if led_buzzer_thread and led_buzzer_thread.is_alive():
-        led_buzzer_thread.join()
     led.off()
     buzzer.off()
 
+# ==============================
+# OPENCV TUNING
+# ==============================
+# Make sure the SIMD (NEON on the Pi) code paths are used and let
+# detectMultiScale spread its work over all cores
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 4)
+
 # ==============================
 # LOAD FACE CASCADE
 # ==============================
@@ -111,49 +131,97 @@ face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
 # ==============================
 # PRINT FUNCTION
 # ==============================
+printer = None
+printer_lock = threading.Lock()
+
+def get_printer():
+    """Open the printer device once and keep it open between jobs."""
+    global printer
+    if printer is None:
+        printer = File(PRINTER_DEVICE)
+    return printer
+
+def close_printer():
+    global printer
+    if printer is not None:
+        try:
+            printer.close()
+        except Exception:
+            pass
+        printer = None
+
+atexit.register(close_printer)
+
 def print_image(image_path):
-    try:
-        p = File(PRINTER_DEVICE)
-        p._raw(b'\x1B\x40')  # reset
-        p.image(
-            image_path,
-            impl="bitImageRaster",
-            high_density_vertical=True,
-            high_density_horizontal=True,
-            center=True
-        )
-        p.text("\n\n")
-        p.cut()
-        p.close()
-        print("🖨️ Printed successfully")
-        return True
-    except Exception as e:
-        print(f"❌ Print error: {e}")
-        return False
+    # One job at a time so concurrent prints can't interleave on the device
+    with printer_lock:
+        try:
+            p = get_printer()
+            p._raw(b'\x1B\x40')  # reset
+            p.image(
+                image_path,
+                impl="bitImageRaster",
+                high_density_vertical=True,
+                high_density_horizontal=True,
+                center=True
+            )
+            p.text("\n\n")
+            p.cut()
+            print("🖨️ Printed successfully")
+            return True
+        except Exception as e:
+            print(f"❌ Print error: {e}")
+            close_printer()  # Reopen on the next job
+            return False
 
 # ==============================
 # WEBSOCKET SEND
 # ==============================
-async def ws_send_image(image_path, ws_server):
-    attempt = 0
-    while True:
+ws_loop = uvloop.new_event_loop() if UVLOOP_AVAILABLE else asyncio.new_event_loop()
+ws_loop_thread = None
+ws_conn = None
+ws_lock = asyncio.Lock()
+
+def start_ws_loop():
+    """Run the WebSocket event loop in a background thread (once)."""
+    global ws_loop_thread
+    if ws_loop_thread and ws_loop_thread.is_alive():
+        return
+    ws_loop_thread = threading.Thread(target=ws_loop.run_forever, daemon=True)
+    ws_loop_thread.start()
+
+async def ws_close():
+    global ws_conn
+    if ws_conn is not None:
         try:
-            print(f"🌐 WebSocket connect attempt {attempt + 1}")
-            async with websockets.connect(
-                ws_server,
-                max_size=10_000_000,
-                open_timeout=WS_TIMEOUT,
-                close_timeout=WS_TIMEOUT
-            ) as ws:
-
-                with open(image_path, "rb") as f:
-                    encoded = base64.b64encode(f.read())
-
-                await ws.send(encoded)
+            await ws_conn.close()
+        except Exception:
+            pass
+        ws_conn = None
+
+async def ws_send_image(image_bytes, ws_server):
+    global ws_conn
+    attempt = 0
+    reconnected = False
+    async with ws_lock:
+        while True:
+            try:
+                # Reuse the open connection, only handshake when needed
+                if ws_conn is None:
+                    print(f"🌐 WebSocket connect attempt {attempt + 1}")
+                    ws_conn = await websockets.connect(
+                        ws_server,
+                        max_size=10_000_000,
+                        open_timeout=WS_TIMEOUT,
+                        close_timeout=WS_TIMEOUT,
+                        compression=None  # JPEG doesn't deflate, skip the zlib pass
+                    )
+
+                # Raw bytes go out as a binary frame (no base64 inflation)
+                await ws_conn.send(image_bytes)
                 print("📤 Image sent")
 
-                response = await ws.recv()
-                receipt_bytes = base64.b64decode(response)
+                receipt_bytes = await asyncio.wait_for(ws_conn.recv(), WS_RECV_TIMEOUT)
 
                 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
                 ts = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -165,15 +233,42 @@ async def ws_send_image(image_path, ws_server):
                 print(f"📥 Receipt saved: {receipt_path}")
                 return receipt_path
 
-        except Exception as e:
-            attempt += 1
-            print(f"⚠️ WebSocket error: {e}")
-            if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
-                return None
-            await asyncio.sleep(WS_RETRY_DELAY)
-
-def send_image_to_server(image_path, ws_server):
-    return asyncio.run(ws_send_image(image_path, ws_server))
+            except asyncio.CancelledError:
+                # Timed out by the caller: drop the connection so a late
+                # receipt can't be read as the answer to the next capture
+                await ws_close()
+                raise
+
+            except websockets.exceptions.ConnectionClosed as e:
+                # Stale connection (server restarted / idle drop): reconnect
+                # right away once, after that back off like any other error
+                attempt += 1
+                print(f"⚠️ WebSocket closed: {e}")
+                ws_conn = None
+                if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
+                    return None
+                if reconnected:
+                    await asyncio.sleep(WS_RETRY_DELAY)
+                reconnected = True
+
+            except Exception as e:
+                attempt += 1
+                print(f"⚠️ WebSocket error: {e}")
+                await ws_close()
+                if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
+                    return None
+                await asyncio.sleep(WS_RETRY_DELAY)
+
+def send_image_to_server(image_bytes, ws_server):
+    start_ws_loop()
+    future = asyncio.run_coroutine_threadsafe(ws_send_image(image_bytes, ws_server), ws_loop)
+    try:
+        return future.result(timeout=WS_SEND_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        # Stop the retry loop so the next capture gets a clean connection
+        future.cancel()
+        print(f"⚠️ WebSocket send timed out after {WS_SEND_TIMEOUT}s")
+        return None
 
 # ==============================
 # CAPTURE FUNCTION
@@ -191,18 +286,30 @@ def do_capture(ws_server):
         stop_blinking()
         return False
 
-    for _ in range(FLUSH_FRAMES):
-        cap.read()
-        time.sleep(0.05)
+    # Keep only the newest frame in the driver queue (no stale-frame flushing)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    # MJPEG over USB instead of raw YUYV, at a fixed resolution
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
 
-    ret, frame = cap.read()
+    # The camera is opened fresh for each capture: the first frames come out
+    # dark until auto-exposure settles, so drop a few (grab() doesn't decode)
+    for _ in range(CAMERA_WARMUP_FRAMES):
+        cap.grab()
+
+    cap.grab()
+    ret, frame = cap.retrieve()
     if not ret:
         cap.release()
         stop_blinking()
         return False
 
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+    small = cv2.resize(gray, (0, 0), fx=DETECT_SCALE, fy=DETECT_SCALE,
+                       interpolation=cv2.INTER_AREA)
+    faces = face_cascade.detectMultiScale(small, FACE_SCALE_FACTOR, 5,
+                                          minSize=(DETECT_MIN_SIZE, DETECT_MIN_SIZE))
 
     if len(faces) == 0:
         print("⚠️ No face detected")
@@ -210,14 +317,27 @@ def do_capture(ws_server):
         stop_blinking()
         return False
 
-    for (x, y, w, h) in faces:
-        cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 255, 255), 3)
+    # Scale all boxes back up to the full-resolution frame in one array op
+    boxes = (np.asarray(faces) / DETECT_SCALE).astype(np.int32)
+    for (x, y, w, h) in boxes:
+        cv2.rectangle(frame, (int(x), int(y)), (int(x+w), int(y+h)), (255, 255, 255), 3)
 
-    cv2.imwrite(IMAGE_PATH, frame)
     cap.release()
+
+    # Encode in memory and send the buffer directly (no SD card roundtrip)
+    ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                            cv2.IMWRITE_JPEG_OPTIMIZE, 1])
     stop_blinking()
+    if not ok:
+        print("❌ JPEG encode failed")
+        return False
+    image_bytes = jpeg.tobytes()
+
+    if debug_save:
+        with open(IMAGE_PATH, "wb") as f:
+            f.write(image_bytes)
 
-    receipt = send_image_to_server(IMAGE_PATH, ws_server)
+    receipt = send_image_to_server(image_bytes, ws_server)
     if receipt:
         print_image(receipt)
         return True
@@ -230,21 +350,28 @@ def do_capture(ws_server):
 # ==============================
 # HTTP ENDPOINTS
 # ==============================
+# Constant body: nothing to serialize per probe
+HEALTH_BODY = b'{"status":"ok"}\n'
+
 @app.route('/health')
 def health():
-    return jsonify({"status": "ok"})
+    return Response(HEALTH_BODY, mimetype='application/json',
+                    headers={'Cache-Control': 'max-age=1'})
 
 @app.route('/capture', methods=['GET', 'POST'])
 def capture():
     global capture_triggered, last_capture_time
 
-    if capture_triggered:
-        return jsonify({"error": "busy"}), 429
+    # Requests run on several threads now, so check-and-set atomically
+    with capture_state_lock:
+        if capture_triggered:
+            return jsonify({"error": "busy"}), 429
+
+        if time.time() - last_capture_time < CAPTURE_COOLDOWN:
+            return jsonify({"error": "cooldown"}), 429
 
-    if time.time() - last_capture_time < CAPTURE_COOLDOWN:
-        return jsonify({"error": "cooldown"}), 429
+        capture_triggered = True
 
-    capture_triggered = True
     try:
         ok = do_capture(app.config['WS_SERVER'])
         if ok:
@@ -261,9 +388,14 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--server', default='ws://172.20.10.2:8765')
     parser.add_argument('--port', type=int, default=HTTP_PORT)
+    parser.add_argument('--debug-save', action='store_true', help=f'Also write each capture to {IMAGE_PATH}')
     args = parser.parse_args()
 
+    global debug_save
+    debug_save = args.debug_save
+
     app.config['WS_SERVER'] = args.server
+    start_ws_loop()
 
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -274,7 +406,10 @@ def main():
         ip = "localhost"
 
     print(f"🌐 http://{ip}:{args.port}/capture")
-    app.run(host='0.0.0.0', port=args.port, debug=False)
+    if WAITRESS_AVAILABLE:
+        serve(app, host='0.0.0.0', port=args.port, threads=HTTP_THREADS)
+    else:
+        app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
 
 # ==============================
 # START
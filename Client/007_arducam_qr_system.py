@@ -19,10 +19,14 @@ Usage:
     python 007_arducam_qr_system.py --server ws://192.168.0.116:8765 --preview
 
 Requirements:
-    pip install flask websockets python-escpos pillow opencv-python
+    pip install flask waitress websockets uvloop python-escpos pillow opencv-python
+    sudo apt install python3-picamera2  (optional, faster rpicam captures)
+    face_detection_yunet_2023mar_int8.onnx next to this script (optional,
+    faster and more accurate than the Haar cascade)
 """
 
 import os
+import shutil
 import subprocess
 
 # Check if display is available BEFORE importing cv2
@@ -40,15 +44,39 @@ if not DISPLAY_AVAILABLE:
 
 from escpos.printer import File
 import cv2
+import numpy as np
 import time
 import asyncio
 import websockets
-import base64
 from datetime import datetime
+from pathlib import Path
 from flask import Flask, jsonify, request
 import socket
 import argparse
 import threading
+import atexit
+import concurrent.futures
+
+# Production WSGI server (optional, falls back to Flask's threaded server)
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+# uvloop: faster event loop for the WebSocket client (optional)
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# psutil: find the process holding our port without spawning fuser (optional)
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
 
 # ==============================
 # CONFIG (edit these directly)
@@ -56,20 +84,29 @@ import threading
 PRINTER_DEVICE = '/dev/usb/lp0'
 CAMERA_INDEX = 0
 CAPTURE_COOLDOWN = 5
-FLUSH_FRAMES = 3
 
-IMAGE_PATH = "capture.jpg"
+# RAM-backed scratch dir for rpicam-still output (tmpfs, no SD card writes)
+SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+IMAGE_PATH = os.path.join(SCRATCH_DIR, "capture.jpg")  # rpicam-still output (V4L2 frames stay in memory)
+JPEG_QUALITY = 85
 OUTPUT_FOLDER = "output"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FACE_CASCADE_PATH = os.path.join(BASE_DIR, "haarcascade_frontalface_default.xml")
+# Optional int8 YuNet model (OpenCV 4.8+), preferred over Haar when present
+FACE_YUNET_PATH = os.path.join(BASE_DIR, "face_detection_yunet_2023mar_int8.onnx")
+FACE_YUNET_SCORE = 0.6
 
 HTTP_PORT = 5001
+HTTP_THREADS = 4
 WS_SERVER_DEFAULT = 'ws://172.20.10.2:8765'
 
 WS_TIMEOUT = 5
 WS_RETRY_DELAY = 3
 WS_MAX_RETRIES = None  # None = infinite retries
+WS_PING_INTERVAL = 20
+WS_PING_TIMEOUT = 10
+WS_SEND_TIMEOUT = 60  # upper bound for one capture's send + receipt
 
 LED_PIN = 24
 BUZZER_PIN = 23
@@ -77,19 +114,32 @@ BUZZER_PIN = 23
 # Camera resolution
 CAMERA_WIDTH = 1280
 CAMERA_HEIGHT = 720
+CAMERA_WARMUP_FRAMES = 5  # Frames dropped after opening while auto-exposure settles
+
+# Face detection pyramid step (1.3 evaluates far fewer scales than 1.1)
+FACE_SCALE_FACTOR = 1.3
+FACE_MIN_NEIGHBORS = 3
+# Kiosk at a fixed distance: face size range in pixels of a CAMERA_WIDTH frame
+# (scaled to the actual detection image, so fewer pyramid levels are scanned)
+FACE_MIN_SIZE = 80
+FACE_MAX_SIZE = 400
+PREVIEW_DETECT_EVERY = 3  # preview runs detection on every Nth frame
+DEBUG_FACE_MISS = False   # save the face-check image when no face is found
+
+# Detection runs on shrunken frames (Haar cost scales with image area)
+PREVIEW_DETECT_SCALE = 0.25   # preview: 1280x720 -> 320x180
+DETECT_MAX_DIM = 640          # capture face checks: longest side in pixels
 
 # ==============================
 # GLOBAL STATE
 # ==============================
 capture_triggered = False
 last_capture_time = 0
+capture_state_lock = threading.Lock()
 preview_running = False
-preview_frame = None
+preview_frame = None  # latest published preview buffer (read under preview_lock)
 preview_lock = threading.Lock()
 
-led_buzzer_thread = None
-led_buzzer_stop = threading.Event()
-
 app = Flask(__name__)
 
 # ==============================
@@ -113,74 +163,100 @@ except Exception as e:
 # ==============================
 # LED & BUZZER CONTROL
 # ==============================
-def led_buzzer_blink(blink_interval=0.5):
-    if not GPIO_ENABLED:
-        return
-    while not led_buzzer_stop.is_set():
-        led.on()
-        buzzer.on()
-        time.sleep(blink_interval)
-        led.off()
-        buzzer.off()
-        time.sleep(blink_interval)
-
 def start_blinking(blink_interval=0.5):
     if not GPIO_ENABLED:
         return
-    global led_buzzer_thread
-    led_buzzer_stop.clear()
-    led_buzzer_thread = threading.Thread(
-        target=led_buzzer_blink,
-        args=(blink_interval,),
-        daemon=True
-    )
-    led_buzzer_thread.start()
+    # Let gpiozero run the blink pattern itself (off() cancels it)
+    led.blink(on_time=blink_interval, off_time=blink_interval, background=True)
+    buzzer.beep(on_time=blink_interval, off_time=blink_interval, background=True)
 
 def stop_blinking():
     if not GPIO_ENABLED:
         return
-    led_buzzer_stop.set()
-    if led_buzzer_thread and led_buzzer_thread.is_alive():
-        led_buzzer_thread.join()
     led.off()
     buzzer.off()
 
 def countdown_beep_async(seconds=5):
-    """Countdown with beeps (runs in background)."""
-    def beep_thread():
-        print(f"⏱️ Countdown: {seconds} seconds...")
-        for i in range(seconds, 0, -1):
-            print(f"   {i}...")
-            if GPIO_ENABLED:
-                led.on()
-                buzzer.on()
-                time.sleep(0.1)
-                led.off()
-                buzzer.off()
-            time.sleep(0.9)
-        
-        print("   📸 CAPTURE!")
-        if GPIO_ENABLED:
-            led.on()
-            buzzer.on()
-            time.sleep(0.3)
-            led.off()
-            buzzer.off()
+    """Countdown with beeps (gpiozero drives the pins in the background)."""
+    print(f"⏱️ Countdown: {seconds} seconds...")
+    if GPIO_ENABLED:
+        # One short pulse per second, no Python loop needed
+        led.blink(on_time=0.1, off_time=0.9, n=seconds, background=True)
+        buzzer.beep(on_time=0.1, off_time=0.9, n=seconds, background=True)
     
-    t = threading.Thread(target=beep_thread, daemon=True)
+    # Timer fires the final flash; callers can join() it to wait out the countdown
+    t = threading.Timer(seconds, capture_flash)
+    t.daemon = True
     t.start()
     return t
 
+def capture_flash():
+    print("   📸 CAPTURE!")
+    if GPIO_ENABLED:
+        led.blink(on_time=0.3, off_time=0, n=1, background=True)
+        buzzer.beep(on_time=0.3, off_time=0, n=1, background=True)
+
+# ==============================
+# OPENCV TUNING
+# ==============================
+# Make sure the SIMD (NEON on the Pi) code paths are used and let
+# detectMultiScale spread its work over all cores
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 4)
+
 # ==============================
 # LOAD FACE CASCADE
 # ==============================
 face_cascade = None
-if os.path.exists(FACE_CASCADE_PATH):
-    face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
-    print("✅ Face detection enabled")
-else:
-    print(f"⚠️ Face cascade not found: {FACE_CASCADE_PATH}")
-    print("   Face detection disabled")
+face_yunet = None
+face_yunet_lock = threading.Lock()  # setInputSize/detect share state
+
+if os.path.exists(FACE_YUNET_PATH) and hasattr(cv2, 'FaceDetectorYN'):
+    try:
+        face_yunet = cv2.FaceDetectorYN.create(FACE_YUNET_PATH, "", (320, 240), FACE_YUNET_SCORE)
+        print("✅ Face detection enabled (YuNet int8)")
+    except cv2.error as e:
+        print(f"⚠️ YuNet load failed: {e}")
+
+if face_yunet is None:
+    if os.path.exists(FACE_CASCADE_PATH):
+        face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+        print("✅ Face detection enabled (Haar cascade)")
+    else:
+        print(f"⚠️ Face cascade not found: {FACE_CASCADE_PATH}")
+        print("   Face detection disabled")
+
+face_detection_enabled = face_yunet is not None or face_cascade is not None
+
+def detect_faces(image, gray_buf=None):
+    """Return face boxes (x, y, w, h) found in a BGR or grayscale image.
+    
+    gray_buf: optional preallocated (h, w) uint8 array reused for the Haar
+    grayscale conversion.
+    """
+    if face_yunet is not None:
+        if image.ndim == 2:
+            # YuNet wants 3 channels; grayscale-as-BGR works but detects
+            # worse, so callers should pass colour when YuNet is loaded
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        h, w = image.shape[:2]
+        with face_yunet_lock:
+            face_yunet.setInputSize((w, h))
+            _, faces = face_yunet.detect(image)
+        if faces is None:
+            return []
+        return faces[:, :4].astype(np.int32)
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray_buf)
+    k = gray.shape[1] / CAMERA_WIDTH
+    lo, hi = int(FACE_MIN_SIZE * k), int(FACE_MAX_SIZE * k)
+    return face_cascade.detectMultiScale(
+        gray,
+        scaleFactor=FACE_SCALE_FACTOR,
+        minNeighbors=FACE_MIN_NEIGHBORS,
+        minSize=(lo, lo),
+        maxSize=(hi, hi),
+        flags=cv2.CASCADE_SCALE_IMAGE
+    )
 
 # ==============================
 # CHECK CAMERA TYPE
@@ -189,21 +265,18 @@ USE_RPICAM = False
 
 def check_rpicam():
     """Check if rpicam-still is available (for libcamera/Arducam)."""
-    try:
-        result = subprocess.run(['rpicam-still', '--version'], 
-                              capture_output=True, text=True, timeout=5)
-        return result.returncode == 0 or 'rpicam-still' in result.stderr
-    except:
-        return False
+    # A PATH lookup is enough, no need to spawn `rpicam-still --version`
+    return shutil.which('rpicam-still') is not None
 
 def check_v4l2_camera():
     """Check if V4L2 camera (USB webcam) is available."""
+    # Cheap pre-check before touching the driver
+    if not os.path.exists(f"/dev/video{CAMERA_INDEX}"):
+        return False
     cap = cv2.VideoCapture(CAMERA_INDEX)
-    if cap.isOpened():
-        ret, _ = cap.read()
-        cap.release()
-        return ret
-    return False
+    opened = cap.isOpened()
+    cap.release()
+    return opened
 
 # Detect camera type
 if check_rpicam():
@@ -215,31 +288,86 @@ elif check_v4l2_camera():
 else:
     print("❌ No camera detected!")
 
+# ==============================
+# PICAMERA2 (in-process libcamera, optional)
+# ==============================
+# Keeps the camera running with continuous autofocus so captures don't
+# pay for a process fork, libcamera init and an autofocus sweep each time.
+RPICAM_STILL_SIZE = (4624, 3472)
+
+try:
+    from picamera2 import Picamera2
+    PICAMERA2_AVAILABLE = True
+except ImportError:
+    PICAMERA2_AVAILABLE = False
+
+picam = None
+
+def get_picamera():
+    """Start Picamera2 once (still mode, continuous AF). Returns None if unavailable."""
+    global picam, PICAMERA2_AVAILABLE
+    if picam is None and PICAMERA2_AVAILABLE:
+        try:
+            picam = Picamera2()
+            picam.configure(picam.create_still_configuration(main={"size": RPICAM_STILL_SIZE}))
+            picam.start()
+            picam.set_controls({"AfMode": 2, "AfTrigger": 0})  # Continuous autofocus
+            print("✅ Picamera2 started (continuous autofocus)")
+        except Exception as e:
+            print(f"⚠️ Picamera2 failed, falling back to rpicam-still: {e}")
+            picam = None
+            PICAMERA2_AVAILABLE = False
+    return picam
+
+def capture_with_picamera2(cam, output_path):
+    """Capture a full-size still from the running Picamera2 instance."""
+    try:
+        cam.capture_file(output_path)
+        return os.path.exists(output_path)
+    except Exception as e:
+        print(f"❌ Picamera2 capture error: {e}")
+        return False
+
 def capture_with_rpicam(output_path, width=None, height=None, autofocus_time=5000):
-    """Capture image using rpicam-still command."""
+    """Capture image using Picamera2 if available, else the rpicam-still command."""
+    cam = get_picamera()
+    if cam is not None:
+        return capture_with_picamera2(cam, output_path)
+    return wait_rpicam(start_rpicam(output_path, width, height, autofocus_time), output_path)
+
+def start_rpicam(output_path, width=None, height=None, autofocus_time=5000):
+    """Launch rpicam-still without waiting for it, returns the process (or None)."""
+    cmd = [
+        'rpicam-still',
+        '-o', output_path,
+        '-t', str(autofocus_time),
+        '-n',  # No preview
+        '--autofocus-mode', 'auto',  # Enable autofocus
+    ]
+    # Add resolution if specified
+    if width and height:
+        cmd.extend(['--width', str(width), '--height', str(height)])
     try:
-        cmd = [
-            'rpicam-still',
-            '-o', output_path,
-            '-t', str(autofocus_time),
-            '-n',  # No preview
-            '--autofocus-mode', 'auto',  # Enable autofocus
-        ]
-        # Add resolution if specified
-        if width and height:
-            cmd.extend(['--width', str(width), '--height', str(height)])
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        if result.returncode == 0 and os.path.exists(output_path):
-            return True
-        print(f"❌ rpicam-still error: {result.stderr}")
+        return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except Exception as e:
+        print(f"❌ rpicam-still error: {e}")
+        return None
+
+def wait_rpicam(proc, output_path, timeout=30):
+    """Wait for a start_rpicam() process, True if it wrote output_path."""
+    if proc is None:
         return False
+    try:
+        _, stderr = proc.communicate(timeout=timeout)
     except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
         print("❌ rpicam-still timeout")
         return False
-    except Exception as e:
-        print(f"❌ rpicam-still error: {e}")
-        return False
+    if proc.returncode == 0 and os.path.exists(output_path):
+        return True
+    print(f"❌ rpicam-still error: {stderr}")
+    return False
 
 # ==============================
 # PRINT FUNCTION
@@ -248,10 +376,91 @@ def capture_with_rpicam(output_path, width=None, height=None, autofocus_time=500
 PRINTER_PAPER_WIDTH = 576  # Full paper width
 PRINTER_IMAGE_WIDTH = 500  # Image width (smaller for margins)
 
+class BufferedFile(File):
+    """escpos File printer that collects _raw() output until flush().
+    
+    A whole receipt (reset + raster + feed + cut) then goes to the USB
+    printer as one write instead of one per command.
+    """
+    def __init__(self, *args, **kwargs):
+        self.pending = bytearray()
+        super().__init__(*args, **kwargs)
+    
+    def _raw(self, msg):
+        self.pending += msg
+    
+    def flush(self):
+        if self.pending:
+            self.device.write(self.pending)
+            self.pending.clear()
+        super().flush()
+
+printer = None
+printer_lock = threading.Lock()
+
+def get_printer():
+    """Open the printer device once and keep it open between jobs."""
+    global printer
+    if printer is None:
+        printer = BufferedFile(PRINTER_DEVICE)
+    return printer
+
+def close_printer():
+    global printer
+    if printer is not None:
+        try:
+            printer.close()
+        except Exception:
+            pass
+        printer = None
+
+atexit.register(close_printer)
+
+ESC_INIT = b'\x1B\x40'
+RASTER_FRAGMENT_ROWS = 960  # rows per GS v 0 block (same split as python-escpos)
+
+def receipt_raster(receipt_bytes):
+    """Turn receipt image bytes into ESC/POS GS v 0 raster commands."""
+    from PIL import Image
+    
+    # Decode straight to grayscale
+    img = cv2.imdecode(np.frombuffer(receipt_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("cannot decode receipt image")
+    h, w = img.shape
+    print(f"📐 Original size: {w}x{h}")
+    
+    # Resize to fit printer width (INTER_AREA is the cheap, clean downscaler)
+    if w > PRINTER_IMAGE_WIDTH:
+        h = int(h * PRINTER_IMAGE_WIDTH / w)
+        w = PRINTER_IMAGE_WIDTH
+        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    
+    # Center the image on a white canvas
+    padding_left = (PRINTER_PAPER_WIDTH - w) // 2
+    canvas = np.full((h, PRINTER_PAPER_WIDTH), 255, dtype=np.uint8)
+    canvas[:, padding_left:padding_left + w] = img
+    print(f"📏 Centered: {w}x{h} on {PRINTER_PAPER_WIDTH}px paper")
+    
+    # Dither to 1-bit like escpos does, then pack 8 dots per byte (1 = black)
+    dots = np.asarray(Image.fromarray(canvas, 'L').convert('1')) == 0
+    packed = np.packbits(dots, axis=1)
+    row_bytes = packed.shape[1]
+    
+    out = bytearray()
+    for y in range(0, h, RASTER_FRAGMENT_ROWS):
+        block = packed[y:y + RASTER_FRAGMENT_ROWS]
+        out += b'\x1Dv0\x00'  # GS v 0, normal (high) density
+        out += row_bytes.to_bytes(2, 'little') + len(block).to_bytes(2, 'little')
+        out += block.tobytes()
+    return bytes(out)
+
 def print_image(image_path):
+    with printer_lock:
+        return _print_image(image_path)
+
+def _print_image(image_path):
     try:
-        from PIL import Image
-        
         print(f"🖨️ Attempting to print: {image_path}")
         
         # Check if file exists
@@ -259,132 +468,200 @@ def print_image(image_path):
             print(f"❌ File not found: {image_path}")
             return False
         
-        # Load and resize image for printer
-        img = Image.open(image_path).convert('L')  # Convert to grayscale
-        print(f"📐 Original size: {img.width}x{img.height}")
-        
-        # Resize to fit printer width
-        if img.width > PRINTER_IMAGE_WIDTH:
-            ratio = PRINTER_IMAGE_WIDTH / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((PRINTER_IMAGE_WIDTH, new_height), Image.LANCZOS)
-        
-        # Center the image by adding white padding on both sides
-        padding_left = (PRINTER_PAPER_WIDTH - img.width) // 2
-        centered_img = Image.new('L', (PRINTER_PAPER_WIDTH, img.height), 255)  # White background
-        centered_img.paste(img, (padding_left, 0))
-        
-        # Save centered image
-        resized_path = "/tmp/print_resized.bmp"
-        centered_img.save(resized_path)
-        print(f"📏 Centered: {img.width}x{img.height} on {PRINTER_PAPER_WIDTH}px paper")
+        raster = receipt_raster(Path(image_path).read_bytes())
         
         print(f"🖨️ Sending to printer...")
         
-        p = File(PRINTER_DEVICE)
-        p._raw(b'\x1B\x40')  # reset
-        p.image(
-            resized_path,
-            impl="bitImageRaster",
-            high_density_vertical=True,
-            high_density_horizontal=True
-        )
+        p = get_printer()
+        p._raw(ESC_INIT + raster)
         p.text("\n\n\n")
         p.cut()
-        p.close()
+        p.flush()  # Everything above goes out in a single write
         print("🖨️ Print command sent!")
         return True
     except Exception as e:
         print(f"❌ Print error: {e}")
         import traceback
         traceback.print_exc()
+        close_printer()  # Reopen on the next job
         return False
 
 # ==============================
 # WEBSOCKET SEND
 # ==============================
-async def ws_send_image(image_path, ws_server):
-    attempt = 0
-    while True:
+ws_loop = uvloop.new_event_loop() if UVLOOP_AVAILABLE else asyncio.new_event_loop()
+ws_loop_thread = None
+ws_conn = None
+ws_lock = asyncio.Lock()
+
+def start_ws_loop():
+    """Run the WebSocket event loop in a background thread (once)."""
+    global ws_loop_thread
+    if ws_loop_thread and ws_loop_thread.is_alive():
+        return
+    ws_loop_thread = threading.Thread(target=ws_loop.run_forever, daemon=True)
+    ws_loop_thread.start()
+
+async def ws_close():
+    global ws_conn
+    if ws_conn is not None:
         try:
-            print(f"🌐 WebSocket connect attempt {attempt + 1}")
-            async with websockets.connect(
-                ws_server,
-                max_size=10_000_000,
-                open_timeout=WS_TIMEOUT,
-                close_timeout=WS_TIMEOUT
-            ) as ws:
-
-                with open(image_path, "rb") as f:
-                    encoded = base64.b64encode(f.read())
-
-                await ws.send(encoded)
+            await ws_conn.close()
+        except Exception:
+            pass
+        ws_conn = None
+
+async def ws_send_image(image_bytes, ws_server):
+    global ws_conn
+    attempt = 0
+    reconnected = False
+    async with ws_lock:
+        while True:
+            try:
+                # Reuse the open connection, only handshake when needed
+                if ws_conn is None:
+                    print(f"🌐 WebSocket connect attempt {attempt + 1}")
+                    ws_conn = await websockets.connect(
+                        ws_server,
+                        max_size=10_000_000,
+                        open_timeout=WS_TIMEOUT,
+                        close_timeout=WS_TIMEOUT,
+                        ping_interval=WS_PING_INTERVAL,  # keep-alive between captures
+                        ping_timeout=WS_PING_TIMEOUT,
+                        compression=None  # JPEG doesn't deflate, skip the zlib pass
+                    )
+
+                # Raw bytes go out as a binary frame (no base64 inflation)
+                await ws_conn.send(image_bytes)
                 print("📤 Image sent")
 
-                response = await ws.recv()
-                receipt_bytes = base64.b64decode(response)
+                # Server answers a binary frame with raw receipt bytes
+                receipt_bytes = await ws_conn.recv()
 
-                os.makedirs(OUTPUT_FOLDER, exist_ok=True)
                 ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                 receipt_path = f"{OUTPUT_FOLDER}/receipt_{ts}.png"
-
-                with open(receipt_path, "wb") as f:
-                    f.write(receipt_bytes)
+                # Disk I/O runs in a worker thread so it doesn't stall the loop
+                await asyncio.to_thread(Path(receipt_path).write_bytes, receipt_bytes)
 
                 print(f"📥 Receipt saved: {receipt_path}")
                 return receipt_path
 
-        except Exception as e:
-            attempt += 1
-            print(f"⚠️ WebSocket error: {e}")
-            if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
-                return None
-            await asyncio.sleep(WS_RETRY_DELAY)
+            except asyncio.CancelledError:
+                # Timed out by the caller: drop the connection so a late
+                # receipt can't be read as the answer to the next capture
+                await ws_close()
+                raise
 
-def send_image_to_server(image_path, ws_server):
-    return asyncio.run(ws_send_image(image_path, ws_server))
+            except websockets.exceptions.ConnectionClosed as e:
+                # Stale connection (server restarted / idle drop): reconnect
+                # right away once, after that back off like any other error
+                attempt += 1
+                print(f"⚠️ WebSocket closed: {e}")
+                ws_conn = None
+                if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
+                    return None
+                if reconnected:
+                    await asyncio.sleep(WS_RETRY_DELAY)
+                reconnected = True
+
+            except Exception as e:
+                attempt += 1
+                print(f"⚠️ WebSocket error: {e}")
+                await ws_close()
+                if WS_MAX_RETRIES and attempt >= WS_MAX_RETRIES:
+                    return None
+                await asyncio.sleep(WS_RETRY_DELAY)
+
+def send_image_to_server(image_bytes, ws_server):
+    start_ws_loop()
+    future = asyncio.run_coroutine_threadsafe(ws_send_image(image_bytes, ws_server), ws_loop)
+    try:
+        return future.result(timeout=WS_SEND_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        # Stop the retry loop so the next capture gets a clean connection
+        future.cancel()
+        print(f"⚠️ WebSocket send timed out after {WS_SEND_TIMEOUT}s")
+        return None
 
 # ==============================
 # CAPTURE FUNCTION
 # ==============================
+def shrink_for_detection(image, max_dim=DETECT_MAX_DIM):
+    """Downscale image so its longest side is at most max_dim."""
+    h, w = image.shape[:2]
+    scale = max_dim / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def encode_jpeg(frame):
+    """JPEG-encode a frame in memory, returns bytes or None."""
+    ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                            cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    return jpeg.tobytes() if ok else None
+
 def do_capture(ws_server):
     global preview_frame
+    full_proc = None  # rpicam-still full shot, started early when possible
     
     # Step 1: Quick face detection check (no countdown yet)
-    if face_cascade is not None and USE_RPICAM:
+    if face_detection_enabled and USE_RPICAM:
         print("👀 Quick face check...")
-        check_path = "/tmp/face_check.jpg"
+        cam = get_picamera()
         
-        # Quick capture for face detection (2 seconds)
-        if not capture_with_rpicam(check_path, width=1280, height=960, autofocus_time=2000):
-            print("❌ Face check capture failed")
-            stop_blinking()
-            return False
-        
-        check_frame = cv2.imread(check_path)
-        try:
-            os.remove(check_path)
-        except:
-            pass
-        
-        if check_frame is None:
-            print("❌ Failed to load check image")
-            stop_blinking()
-            return False
+        if cam is not None:
+            # Grab the frame straight into memory (no JPEG encode, no file)
+            try:
+                frame = cam.capture_array("main")
+            except Exception as e:
+                print(f"❌ Face check capture failed: {e}")
+                stop_blinking()
+                return False
+            # Picamera2's default "BGR888" format is R,G,B in memory; shrink
+            # first so the channel swap only touches the small image
+            check_frame = cv2.cvtColor(shrink_for_detection(frame), cv2.COLOR_RGB2BGR)
+        else:
+            check_path = os.path.join(SCRATCH_DIR, "face_check.jpg")
+            
+            # Quick capture for face detection (2 seconds)
+            if not capture_with_rpicam(check_path, width=1280, height=960, autofocus_time=2000):
+                print("❌ Face check capture failed")
+                stop_blinking()
+                return False
+            
+            # Let the JPEG decoder emit a half-size (640x480) image directly
+            # (DCT scaling skips most of the decode). YuNet is trained on
+            # colour, so keep colour for it; Haar only needs grayscale
+            check_flags = (cv2.IMREAD_REDUCED_COLOR_2 if face_yunet is not None
+                           else cv2.IMREAD_REDUCED_GRAYSCALE_2)
+            check_frame = cv2.imread(check_path, check_flags)
+            try:
+                os.remove(check_path)
+            except:
+                pass
+            
+            if check_frame is None:
+                print("❌ Failed to load check image")
+                stop_blinking()
+                return False
+            
+            # The camera is free again: start the full shot now so process
+            # startup and autofocus overlap the face detection below
+            full_proc = start_rpicam(IMAGE_PATH, width=4624, height=3472, autofocus_time=5000)
         
-        # Check for face (more lenient settings)
-        gray = cv2.cvtColor(check_frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=3,      # More lenient (was 5)
-            minSize=(30, 30)     # Detect smaller faces
-        )
+        # Check for face
+        faces = detect_faces(shrink_for_detection(check_frame))
         
         if len(faces) == 0:
-            # Save debug image to see what camera captured
-            cv2.imwrite("/tmp/face_debug.jpg", check_frame)
-            print("⚠️ No face detected (debug image saved to /tmp/face_debug.jpg)")
+            if full_proc is not None:
+                full_proc.kill()
+                full_proc.wait()
+            if DEBUG_FACE_MISS:
+                # Save debug image to see what camera captured
+                cv2.imwrite("/tmp/face_debug.jpg", check_frame)
+                print("⚠️ No face detected (debug image saved to /tmp/face_debug.jpg)")
+            else:
+                print("⚠️ No face detected")
             stop_blinking()
             return False
         
@@ -395,21 +672,32 @@ def do_capture(ws_server):
         # Start countdown in background (5 seconds = matches autofocus time)
         countdown_thread = countdown_beep_async(5)
         
-        # Capture at good quality (4624x3472 = 16MP) - autofocus runs during countdown
-        if not capture_with_rpicam(IMAGE_PATH, width=4624, height=3472, autofocus_time=5000):
+        # Picamera2 captures instantly (autofocus is continuous), so wait
+        # for the countdown instead of letting autofocus time it
+        if get_picamera() is not None:
+            countdown_thread.join()
+            ok = capture_with_rpicam(IMAGE_PATH, width=4624, height=3472)
+        else:
+            # Capture at good quality (4624x3472 = 16MP) - autofocus runs during countdown
+            if full_proc is None:
+                full_proc = start_rpicam(IMAGE_PATH, width=4624, height=3472, autofocus_time=5000)
+            ok = wait_rpicam(full_proc, IMAGE_PATH)
+        
+        if not ok:
             print("❌ Full capture failed")
             stop_blinking()
             return False
+        # rpicam-still already wrote a JPEG: send it as is, no decode/re-encode
+        image_bytes = Path(IMAGE_PATH).read_bytes()
         print("📸 Captured!")
     
     elif preview_running and preview_frame is not None:
-        with preview_lock:
-            frame = preview_frame.copy()
-        
-        # Face check for V4L2
-        if face_cascade is not None:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+        # Face check for V4L2 (the resize doubles as the copy out of the
+        # shared preview buffer)
+        if face_detection_enabled:
+            with preview_lock:
+                small = shrink_for_detection(preview_frame)
+            faces = detect_faces(small)
             if len(faces) == 0:
                 print("⚠️ No face detected")
                 stop_blinking()
@@ -420,11 +708,10 @@ def do_capture(ws_server):
         countdown_beep_async(5)
         time.sleep(5)  # Wait for countdown to finish
         
-        # Re-capture fresh frame after countdown
+        # Encode the freshest frame after countdown (straight from the
+        # shared buffer, no intermediate copy)
         with preview_lock:
-            frame = preview_frame.copy()
-        
-        cv2.imwrite(IMAGE_PATH, frame)
+            image_bytes = encode_jpeg(preview_frame)
         print("📸 Captured!")
     
     else:
@@ -434,12 +721,17 @@ def do_capture(ws_server):
             stop_blinking()
             return False
         
+        # Keep only the newest frame in the driver queue (no stale-frame flushing)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # MJPEG over USB instead of raw YUYV
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
         
-        for _ in range(FLUSH_FRAMES):
-            cap.read()
-            time.sleep(0.05)
+        # The camera is opened fresh for each capture: the first frames come
+        # out dark until auto-exposure settles, so drop a few (grab() doesn't decode)
+        for _ in range(CAMERA_WARMUP_FRAMES):
+            cap.grab()
         
         # Quick face check first
         ret, frame = cap.read()
@@ -450,9 +742,8 @@ def do_capture(ws_server):
             return False
         
         # Face check for V4L2
-        if face_cascade is not None:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+        if face_detection_enabled:
+            faces = detect_faces(shrink_for_detection(frame))
             if len(faces) == 0:
                 cap.release()
                 print("⚠️ No face detected")
@@ -473,13 +764,17 @@ def do_capture(ws_server):
             stop_blinking()
             return False
         
-        cv2.imwrite(IMAGE_PATH, frame)
+        image_bytes = encode_jpeg(frame)
         print("📸 Captured!")
 
     stop_blinking()
 
+    if image_bytes is None:
+        print("❌ JPEG encode failed")
+        return False
+
     # Send to server and print
-    receipt = send_image_to_server(IMAGE_PATH, ws_server)
+    receipt = send_image_to_server(image_bytes, ws_server)
     if receipt:
         print_image(receipt)
         return True
@@ -493,7 +788,7 @@ def do_capture(ws_server):
 # ==============================
 # PREVIEW THREAD (OpenCV)
 # ==============================
-def preview_thread_func(face_cascade_ref):
+def preview_thread_func(detect_enabled):
     global preview_running, preview_frame
     
     cap = cv2.VideoCapture(CAMERA_INDEX)
@@ -501,6 +796,10 @@ def preview_thread_func(face_cascade_ref):
         print("❌ Preview: Camera open failed")
         return
     
+    # Keep only the newest frame in the driver queue so the preview isn't stale
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    # MJPEG over USB instead of raw YUYV
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
     
@@ -520,29 +819,57 @@ def preview_thread_func(face_cascade_ref):
         print("   Camera is running for capture, but no preview window")
         print("   To see preview: run directly on Pi desktop or use VNC")
     
+    camera_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    frame_interval = 1.0 / camera_fps
+    
+    # Two preallocated frames: the camera decodes into the back buffer
+    # while do_capture may be copying the published one
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or CAMERA_HEIGHT
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or CAMERA_WIDTH
+    buffers = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(2)]
+    back = 0
+    
+    # Detection scratch buffers, reused every frame instead of reallocated
+    small_size = (int(w * PREVIEW_DETECT_SCALE), int(h * PREVIEW_DETECT_SCALE))
+    small_buf = np.empty((small_size[1], small_size[0], 3), dtype=np.uint8)
+    small_gray_buf = np.empty((small_size[1], small_size[0]), dtype=np.uint8)
+    
     preview_running = True
+    miss_count = 0
+    frame_count = 0
+    faces = []
     
     while preview_running:
-        ret, frame = cap.read()
+        # cap.read() blocks until the next frame, so no fixed sleep is needed
+        ret, frame = cap.read(image=buffers[back])
         if not ret:
-            time.sleep(0.01)
+            # Back off gradually while the camera is not delivering frames
+            miss_count += 1
+            time.sleep(min(0.5, 0.01 * miss_count))
             continue
+        miss_count = 0
+        frame_start = time.monotonic()
         
-        # Store frame for capture
+        # Publish the frame for capture and flip to the other buffer
         with preview_lock:
-            preview_frame = frame.copy()
+            preview_frame = frame
+        back = 1 - back
         
         # Only show window if display available
         if has_window:
-            # Face detection for display
+            # Draw on a copy: frame is the buffer do_capture reads from
             display_frame = frame.copy()
-            if face_cascade_ref is not None:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade_ref.detectMultiScale(gray, 1.1, 5)
+            if detect_enabled:
+                # Faces barely move between frames: only re-detect every Nth one
+                if frame_count % PREVIEW_DETECT_EVERY == 0:
+                    cv2.resize(frame, small_size, dst=small_buf, interpolation=cv2.INTER_AREA)
+                    faces = detect_faces(small_buf, gray_buf=small_gray_buf)
+                frame_count += 1
                 
-                # Draw bounding boxes (green)
+                # Draw bounding boxes (green), scaled back to full size
+                k = int(round(1 / PREVIEW_DETECT_SCALE))
                 for (x, y, w, h) in faces:
-                    cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                    cv2.rectangle(display_frame, (x*k, y*k), ((x+w)*k, (y+h)*k), (0, 255, 0), 2)
                 
                 # Show face count
                 cv2.putText(display_frame, f"Faces: {len(faces)}", (10, 30),
@@ -555,9 +882,13 @@ def preview_thread_func(face_cascade_ref):
                     break
             except:
                 has_window = False
-        else:
-            # No window, just keep camera running for capture
-            time.sleep(0.03)  # ~30fps
+            
+            # Detection fell behind the camera: drop the frames that queued
+            # up meanwhile so the next read (and capture) isn't stale
+            dt = time.monotonic() - frame_start
+            if dt > frame_interval:
+                for _ in range(int(dt * camera_fps) - 1):
+                    cap.grab()
     
     preview_running = False
     cap.release()
@@ -574,7 +905,7 @@ def health():
         "status": "ok",
         "preview": preview_running,
         "gpio": GPIO_ENABLED,
-        "face_detection": face_cascade is not None
+        "face_detection": face_detection_enabled
     })
 
 @app.route('/capture', methods=['GET', 'POST'])
@@ -584,28 +915,81 @@ def capture():
     qr_code = request.args.get('qr', 'manual')
     print(f"\n📱 Capture triggered: {qr_code}")
 
-    if capture_triggered:
-        return jsonify({"success": False, "error": "Capture in progress"}), 429
+    # waitress serves requests on several threads, so check-and-set atomically
+    with capture_state_lock:
+        if capture_triggered:
+            return jsonify({"success": False, "error": "Capture in progress"}), 429
 
-    if time.time() - last_capture_time < CAPTURE_COOLDOWN:
-        remaining = int(CAPTURE_COOLDOWN - (time.time() - last_capture_time))
-        return jsonify({"success": False, "error": f"Cooldown: {remaining}s"}), 429
+        if time.time() - last_capture_time < CAPTURE_COOLDOWN:
+            remaining = int(CAPTURE_COOLDOWN - (time.time() - last_capture_time))
+            return jsonify({"success": False, "error": f"Cooldown: {remaining}s"}), 429
 
-    capture_triggered = True
+        capture_triggered = True
+
+    ok = False
     try:
         ok = do_capture(app.config['WS_SERVER'])
-        if ok:
-            last_capture_time = time.time()
-            return jsonify({"success": True, "message": "Captured and printed!"})
-        return jsonify({"success": False, "error": "Capture failed (no face?)"}), 500
     finally:
-        capture_triggered = False
+        with capture_state_lock:
+            if ok:
+                last_capture_time = time.time()
+            capture_triggered = False
+
+    if ok:
+        return jsonify({"success": True, "message": "Captured and printed!"})
+    return jsonify({"success": False, "error": "Capture failed (no face?)"}), 500
 
 # ==============================
 # KILL PORT FUNCTION
 # ==============================
+def port_is_free(port):
+    """True if we could bind the port right now."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        s.bind(('0.0.0.0', port))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def wait_port_free(port, timeout=3.0):
+    """Poll until the port can be bound (usually well under 100 ms)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if port_is_free(port):
+            return True
+        time.sleep(0.05)
+    return False
+
 def kill_port(port):
     """Kill any process using the specified port."""
+    if PSUTIL_AVAILABLE:
+        try:
+            pids = {c.pid for c in psutil.net_connections(kind='tcp')
+                    if c.laddr and c.laddr.port == port and c.pid and c.pid != os.getpid()}
+        except psutil.AccessDenied:
+            pids = None  # Not root: let fuser try
+        if pids is not None:
+            if not pids:
+                return False
+            procs = []
+            for pid in pids:
+                try:
+                    proc = psutil.Process(pid)
+                    proc.terminate()
+                    procs.append(proc)
+                except psutil.NoSuchProcess:
+                    pass
+            # Escalate to SIGKILL for anything still alive after 1s
+            _, alive = psutil.wait_procs(procs, timeout=1)
+            for proc in alive:
+                proc.kill()
+            print(f"🔪 Killed process on port {port}")
+            wait_port_free(port)
+            return True
+    
     try:
         result = subprocess.run(
             ['fuser', '-k', f'{port}/tcp'],
@@ -614,7 +998,7 @@ def kill_port(port):
         )
         if result.returncode == 0:
             print(f"🔪 Killed process on port {port}")
-            time.sleep(2)  # Wait for port to be released
+            wait_port_free(port)  # Wait for port to be released
             return True
     except:
         pass
@@ -634,11 +1018,13 @@ def main():
     args = parser.parse_args()
 
     if args.no_face:
-        global face_cascade
-        face_cascade = None
+        global face_detection_enabled
+        face_detection_enabled = False
         print("⚠️ Face detection disabled (--no-face)")
 
     app.config['WS_SERVER'] = args.server
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    start_ws_loop()
 
     # Kill any existing process on our port
     print(f"🔍 Checking port {args.port}...")
@@ -653,6 +1039,10 @@ def main():
     except:
         ip = "localhost"
 
+    # Bring the camera up now so autofocus has converged by the first capture
+    if USE_RPICAM:
+        get_picamera()
+
     camera_type = "rpicam (Arducam/libcamera)" if USE_RPICAM else "V4L2 (USB webcam)"
     
     print("\n" + "=" * 50)
@@ -662,7 +1052,7 @@ def main():
     print(f"HTTP:      http://{ip}:{args.port}/capture")
     print(f"Camera:    {camera_type}")
     print(f"GPIO:      {'✅ Enabled' if GPIO_ENABLED else '⚠️ Disabled'}")
-    print(f"Face Det:  {'✅ Enabled' if face_cascade else '⚠️ Disabled'}")
+    print(f"Face Det:  {'✅ Enabled' if face_detection_enabled else '⚠️ Disabled'}")
     print("=" * 50 + "\n")
 
     preview_t = None
@@ -671,7 +1061,7 @@ def main():
     if args.preview and not USE_RPICAM:
         preview_t = threading.Thread(
             target=preview_thread_func,
-            args=(face_cascade,),
+            args=(face_detection_enabled,),
             daemon=False
         )
         preview_t.start()
@@ -683,7 +1073,10 @@ def main():
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+            if WAITRESS_AVAILABLE:
+                serve(app, host='0.0.0.0', port=args.port, threads=HTTP_THREADS)
+            else:
+                app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
             break  # If successful, exit loop
         except KeyboardInterrupt:
             print("\n🛑 Shutting down...")
@@ -692,7 +1085,7 @@ def main():
             if "Address already in use" in str(e):
                 print(f"⚠️ Port {args.port} in use, attempt {attempt + 1}/{max_retries}")
                 kill_port(args.port)
-                time.sleep(3)
+                wait_port_free(args.port)
                 if attempt == max_retries - 1:
                     print(f"❌ Failed to start after {max_retries} attempts")
             else:
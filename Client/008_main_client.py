@@ -22,21 +22,46 @@ Usage:
     python 008_main_client.py --server ws://192.168.0.100:8765
 
 Requirements:
-    pip install flask websockets python-escpos pillow opencv-python gpiozero python-dotenv
+    pip install flask waitress websockets uvloop python-escpos pillow opencv-python gpiozero python-dotenv
+    sudo apt install python3-picamera2  (optional, no autofocus wait after the countdown)
 """
 
 import os
+import fcntl
+import struct
 import subprocess
 import time
 import asyncio
 import websockets
-import base64
 import json
 import threading
 from datetime import datetime
 from flask import Flask, Response, jsonify, request
 import socket
 import argparse
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+# Production WSGI server (optional, falls back to Flask's threaded server)
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+# mDNS advertisement so the server can find this Pi (optional)
+try:
+    from discovery import PotboyServiceRegistration, CLIENT_SERVICE_NAME
+    DISCOVERY_AVAILABLE = True
+except ImportError:
+    DISCOVERY_AVAILABLE = False
+
+# uvloop: faster event loop for the WebSocket client (optional)
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
 
 # Load environment variables
 try:
@@ -50,6 +75,8 @@ except ImportError:
 # ==============================
 PRINTER_DEVICE = os.getenv('PRINTER_DEVICE', '/dev/usb/lp0')
 HTTP_PORT = int(os.getenv('HTTP_PORT', 5001))
+# Each open /stream viewer holds a worker thread, so leave headroom
+HTTP_THREADS = int(os.getenv('HTTP_THREADS', 8))
 RPICAM_INDEX = int(os.getenv('RPICAM_INDEX', 1))
 CAMERA_INDEX = int(os.getenv('CAMERA_INDEX', 0))
 
@@ -58,6 +85,10 @@ _ws_config = os.getenv('WS_SERVER', 'auto').strip()
 WS_SERVER_DEFAULT = None if _ws_config.lower() == 'auto' else _ws_config
 
 WS_TIMEOUT = 5
+WS_PING_INTERVAL = 20
+WS_PING_TIMEOUT = 10
+WS_RECEIPT_TIMEOUT = 60  # server sends nothing back if processing fails
+WS_CHUNK_SIZE = 64 * 1024  # image is streamed in fragments of this size
 COUNTDOWN_SECONDS = 5
 
 LED_PIN = int(os.getenv('LED_PIN', 24))
@@ -67,6 +98,13 @@ BUZZER_PIN = int(os.getenv('BUZZER_PIN', 23))
 IMAGE_PATH = "/tmp/capture.jpg"
 OUTPUT_FOLDER = "output"
 
+# MJPEG scan buffer for rpicam-vid output (must hold a few 640x480 frames)
+STREAM_BUFFER_SIZE = 1 << 20
+STREAM_PIPE_SIZE = 1 << 20  # kernel pipe buffer (default 64 KB is ~1 frame)
+# multipart/x-mixed-replace framing, yielded around each JPEG (no concatenation)
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_PART_END = b'\r\n'
+
 # Printer settings
 PRINTER_PAPER_WIDTH = 576
 PRINTER_IMAGE_WIDTH = 500
@@ -78,9 +116,11 @@ app = Flask(__name__)
 preview_active = False
 capture_in_progress = False
 stream_thread = None
-stream_frame = None
+stream_frame = None  # latest preview frame as JPEG bytes
 stream_lock = threading.Lock()
 stream_process = None  # Track rpicam-vid process
+stream_cap = None  # OpenCV webcam, opened once and kept for reconnects
+stream_cap_lock = threading.Lock()
 ws_server_url = None
 
 # ==============================
@@ -115,24 +155,76 @@ def check_rpicam():
     except:
         return False
 
+# V4L2 capability query: _IOR('V', 0, struct v4l2_capability), 104 bytes
+VIDIOC_QUERYCAP = 0x80685600
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
 def check_opencv_camera():
-    """Check if OpenCV camera is available."""
+    """Check if a V4L2 capture device is available (QUERYCAP only, no streaming)."""
     try:
-        import cv2
-        cap = cv2.VideoCapture(CAMERA_INDEX)
-        if cap.isOpened():
-            ret, _ = cap.read()
-            cap.release()
-            return ret
-    except:
+        fd = os.open(f"/dev/video{CAMERA_INDEX}", os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return False
+    try:
+        cap = bytearray(104)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, cap)
+        # capabilities / device_caps follow driver[16], card[32], bus_info[32], version
+        caps, device_caps = struct.unpack_from('<II', cap, 84)
+        if caps & V4L2_CAP_DEVICE_CAPS:
+            caps = device_caps  # caps of this node, not the whole device
+        return bool(caps & V4L2_CAP_VIDEO_CAPTURE)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+# Probe results are cached so service restarts skip the probes
+CAMERA_PROBE_CACHE = '/tmp/.camera_probe.json'
+CAMERA_PROBE_TTL = 3600  # seconds
+
+def camera_probe_key():
+    """Cache key: same machine/kernel and same camera indexes."""
+    return [list(os.uname()), RPICAM_INDEX, CAMERA_INDEX]
+
+def load_camera_probe():
+    """Return cached (rpicam, v4l2) probe results, or None if stale/missing."""
+    try:
+        if time.time() - os.path.getmtime(CAMERA_PROBE_CACHE) > CAMERA_PROBE_TTL:
+            return None
+        with open(CAMERA_PROBE_CACHE) as f:
+            data = json.load(f)
+        if data.get('key') != camera_probe_key():
+            return None
+        return data['rpicam'], data['v4l2']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_camera_probe(rpicam, v4l2):
+    try:
+        tmp_path = CAMERA_PROBE_CACHE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': camera_probe_key(), 'rpicam': rpicam, 'v4l2': v4l2}, f)
+        os.replace(tmp_path, CAMERA_PROBE_CACHE)
+    except OSError:
         pass
-    return False
 
-# Detect camera type
-if check_rpicam():
+# Detect camera type (both probes run at once, rpicam wins if present)
+probe = load_camera_probe()
+if probe is not None:
+    has_rpicam, has_v4l2 = probe
+else:
+    with ThreadPoolExecutor(max_workers=2) as probe_pool:
+        rpicam_probe = probe_pool.submit(check_rpicam)
+        v4l2_probe = probe_pool.submit(check_opencv_camera)
+    has_rpicam, has_v4l2 = rpicam_probe.result(), v4l2_probe.result()
+    if has_rpicam or has_v4l2:
+        save_camera_probe(has_rpicam, has_v4l2)  # Never cache "no camera"
+
+if has_rpicam:
     USE_RPICAM = True
     print("✅ Camera: rpicam (Arducam/libcamera)")
-elif check_opencv_camera():
+elif has_v4l2:
     USE_RPICAM = False
     print("✅ Camera: OpenCV (USB webcam)")
 else:
@@ -164,29 +256,23 @@ def blink_countdown(seconds):
     # Notify server that capture is starting (freeze frame)
     notify_server('capture_start')
     
+    if GPIO_ENABLED:
+        # One short pulse per second, driven by gpiozero's background thread
+        led.blink(on_time=0.1, off_time=0.9, n=seconds, background=True)
+        buzzer.beep(on_time=0.1, off_time=0.9, n=seconds, background=True)
+    
     for i in range(seconds, 0, -1):
         print(f"   {i}...")
         
         # Send countdown to server for browser display
         notify_server('countdown', i)
-        
-        # Blink
-        if GPIO_ENABLED:
-            led.on()
-            buzzer.on()
-            time.sleep(0.1)
-            led.off()
-            buzzer.off()
-        time.sleep(0.9)
+        time.sleep(1)
     
-    # Final beep
+    # Final beep (doesn't hold up the capture)
     print("   📸 CAPTURE!")
     if GPIO_ENABLED:
-        led.on()
-        buzzer.on()
-        time.sleep(0.3)
-        led.off()
-        buzzer.off()
+        led.blink(on_time=0.3, off_time=0, n=1, background=True)
+        buzzer.beep(on_time=0.3, off_time=0, n=1, background=True)
 
 # ==============================
 # MJPEG STREAM (for preview)
@@ -207,6 +293,33 @@ def stop_stream_process():
         time.sleep(0.5)  # Give camera time to release
 
 
+def get_stream_cap():
+    """Open the webcam once (MJPG passthrough) and reuse it for every /stream.
+    
+    Reopening plus the format/size set() calls restarts V4L2 streaming and
+    reallocates its buffers, which stalls a reconnecting viewer.
+    """
+    global stream_cap
+    import cv2
+    if stream_cap is None or not stream_cap.isOpened():
+        cap = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_V4L2)
+        # Ask the webcam for MJPG and skip OpenCV's decode: read() then hands
+        # back the camera's own JPEG bytes, which go out untouched
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        stream_cap = cap
+    return stream_cap
+
+def release_stream_cap():
+    global stream_cap
+    if stream_cap is not None:
+        stream_cap.release()
+        stream_cap = None
+
+atexit.register(release_stream_cap)
+
 def generate_mjpeg_stream():
     """Generate MJPEG stream from camera."""
     global stream_frame, stream_process
@@ -229,29 +342,56 @@ def generate_mjpeg_stream():
         
         try:
             print(f"🎬 Starting rpicam-vid: {' '.join(cmd)}")
-            stream_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Unbuffered pipe: each readinto() returns whatever is available
+            stream_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                              bufsize=0)
+            # Bigger pipe so rpicam-vid doesn't stall while we're yielding a frame
+            try:
+                fcntl.fcntl(stream_process.stdout.fileno(),
+                            getattr(fcntl, 'F_SETPIPE_SZ', 1031), STREAM_PIPE_SIZE)
+            except OSError:
+                pass  # above /proc/sys/fs/pipe-max-size, keep the default
             
-            # Read MJPEG frames
-            buffer = b''
+            # Read MJPEG frames into one preallocated buffer, scanning by offset
+            buf = bytearray(STREAM_BUFFER_SIZE)
+            mv = memoryview(buf)
+            write_pos = 0
+            start = -1    # SOI offset of the frame being assembled
+            scan_pos = 0  # everything before this was already searched
             frame_count = 0
             while preview_active and not capture_in_progress:
-                chunk = stream_process.stdout.read(4096)
-                if not chunk:
+                if write_pos == len(buf):
+                    # No complete frame in a full buffer: drop it and resync
+                    write_pos, start, scan_pos = 0, -1, 0
+                n = stream_process.stdout.readinto(mv[write_pos:])
+                if not n:
                     # Check for errors
                     stderr_data = stream_process.stderr.read()
                     if stderr_data:
                         print(f"❌ rpicam-vid stderr: {stderr_data.decode()}")
                     print("🎬 No more data from rpicam-vid")
                     break
-                buffer += chunk
-                
-                # Find JPEG markers
-                start = buffer.find(b'\xff\xd8')
-                end = buffer.find(b'\xff\xd9')
+                write_pos += n
                 
-                if start != -1 and end != -1 and end > start:
-                    frame = buffer[start:end+2]
-                    buffer = buffer[end+2:]
+                # Find JPEG markers, only in bytes not searched yet (back up
+                # one byte in case a marker was split across two reads)
+                while True:
+                    if start == -1:
+                        start = buf.find(b'\xff\xd8', max(scan_pos - 1, 0), write_pos)
+                        if start == -1:
+                            scan_pos = write_pos
+                            break
+                        scan_pos = start + 2
+                    end = buf.find(b'\xff\xd9', max(scan_pos - 1, start + 2), write_pos)
+                    if end == -1:
+                        scan_pos = write_pos
+                        break
+                    
+                    frame = mv[start:end+2].tobytes()
+                    # Move the unparsed tail to the front (in place, no realloc)
+                    tail = write_pos - (end + 2)
+                    mv[:tail] = mv[end+2:write_pos]
+                    write_pos, start, scan_pos = tail, -1, 0
                     frame_count += 1
                     
                     if frame_count == 1:
@@ -259,8 +399,9 @@ def generate_mjpeg_stream():
                     elif frame_count % 100 == 0:
                         print(f"🎬 Streamed {frame_count} frames...")
                     
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                    yield MJPEG_PART_HEADER
+                    yield frame
+                    yield MJPEG_PART_END
             
             print(f"🎬 Stream loop ended, preview_active={preview_active}, capture_in_progress={capture_in_progress}")
             stop_stream_process()
@@ -272,33 +413,82 @@ def generate_mjpeg_stream():
     else:
         # Use OpenCV
         import cv2
-        cap = cv2.VideoCapture(CAMERA_INDEX)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        cap = get_stream_cap()
+        read_buf = None  # Reused by read(); only the JPEG bytes are kept
         
         while preview_active:
-            ret, frame = cap.read()
+            with stream_cap_lock:
+                ret, read_buf = cap.read(image=read_buf)
             if not ret:
                 time.sleep(0.1)
                 continue
             
+            frame = read_buf
+            if frame.ndim == 3:
+                # Camera/backend gave us decoded pixels anyway: encode them
+                _, frame = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+            jpeg = frame.tobytes()
+            
             with stream_lock:
-                stream_frame = frame.copy()
+                stream_frame = jpeg
             
-            _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
+            yield MJPEG_PART_HEADER
+            yield jpeg
+            yield MJPEG_PART_END
             
             time.sleep(0.066)  # ~15 fps
-        
-        cap.release()
+        # Camera stays open for the next viewer (released at exit)
+
+# ==============================
+# PICAMERA2 (in-process libcamera, optional)
+# ==============================
+# The preview stream (rpicam-vid) needs the camera to itself, so Picamera2 is
+# opened for the countdown only: continuous autofocus settles while the
+# countdown runs and the shot is taken the moment it ends.
+RPICAM_STILL_SIZE = (4624, 3472)
+
+try:
+    from picamera2 import Picamera2
+    PICAMERA2_AVAILABLE = True
+except ImportError:
+    PICAMERA2_AVAILABLE = False
+
+def open_picamera():
+    """Start Picamera2 in still mode with continuous AF, or None if unavailable."""
+    if not PICAMERA2_AVAILABLE:
+        return None
+    try:
+        cam = Picamera2(RPICAM_INDEX)
+        cam.configure(cam.create_still_configuration(main={"size": RPICAM_STILL_SIZE}))
+        cam.start()
+        cam.set_controls({"AfMode": 2, "AfTrigger": 0})  # Continuous autofocus
+        return cam
+    except Exception as e:
+        print(f"⚠️ Picamera2 failed, using rpicam-still: {e}")
+        return None
+
+def close_picamera(cam):
+    """Release the camera so rpicam-vid can use it again."""
+    try:
+        cam.stop()
+        cam.close()
+    except Exception:
+        pass
 
 # ==============================
 # CAPTURE FUNCTION
 # ==============================
-def capture_image():
-    """Capture image with camera."""
-    if USE_RPICAM:
+def capture_image(cam=None):
+    """Capture image with camera (cam: an open Picamera2, if any)."""
+    if USE_RPICAM and cam is not None:
+        try:
+            cam.capture_file(IMAGE_PATH)
+            print(f"📸 Captured: {IMAGE_PATH}")
+            return True
+        except Exception as e:
+            print(f"❌ Picamera2 capture error: {e}")
+            return False
+    elif USE_RPICAM:
         cmd = [
             'rpicam-still',
             '-o', IMAGE_PATH,
@@ -326,17 +516,23 @@ def capture_image():
         
         with stream_lock:
             if stream_frame is not None:
-                cv2.imwrite(IMAGE_PATH, stream_frame)
+                # Already a JPEG, just write it out
+                with open(IMAGE_PATH, "wb") as f:
+                    f.write(stream_frame)
                 print(f"📸 Captured from stream: {IMAGE_PATH}")
                 return True
         
-        # Fallback: open camera
-        cap = cv2.VideoCapture(CAMERA_INDEX)
+        # Fallback: read from the (shared) camera
+        cap = get_stream_cap()
         if cap.isOpened():
-            ret, frame = cap.read()
-            cap.release()
+            with stream_cap_lock:
+                ret, frame = cap.read()
             if ret:
-                cv2.imwrite(IMAGE_PATH, frame)
+                if frame.ndim == 3:
+                    cv2.imwrite(IMAGE_PATH, frame)
+                else:
+                    with open(IMAGE_PATH, "wb") as f:
+                        f.write(frame.tobytes())  # Already a JPEG
                 print(f"📸 Captured: {IMAGE_PATH}")
                 return True
         
@@ -346,56 +542,101 @@ def capture_image():
 # ==============================
 # WEBSOCKET COMMUNICATION
 # ==============================
+def iter_file_chunks(image_path):
+    """Yield the image file one WS_CHUNK_SIZE piece at a time."""
+    with open(image_path, "rb") as f:
+        while True:
+            chunk = f.read(WS_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+ws_loop = uvloop.new_event_loop() if UVLOOP_AVAILABLE else asyncio.new_event_loop()
+ws_loop_thread = None
+ws_conn = None
+ws_lock = asyncio.Lock()
+
+def start_ws_loop():
+    """Run the WebSocket event loop in a background thread (once)."""
+    global ws_loop_thread
+    if ws_loop_thread and ws_loop_thread.is_alive():
+        return
+    ws_loop_thread = threading.Thread(target=ws_loop.run_forever, daemon=True)
+    ws_loop_thread.start()
+
+async def ws_close():
+    global ws_conn
+    if ws_conn is not None:
+        try:
+            await ws_conn.close()
+        except Exception:
+            pass
+        ws_conn = None
+
+async def ws_connect(ws_server):
+    """Open the shared connection (wss accepts the server's self-signed cert)."""
+    print(f"🌐 Connecting to {ws_server}...")
+    
+    # Create SSL context that doesn't verify self-signed certificates
+    ssl_context = None
+    if ws_server.startswith('wss://'):
+        import ssl
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    
+    return await websockets.connect(
+        ws_server,
+        max_size=15_000_000,
+        open_timeout=WS_TIMEOUT,
+        close_timeout=WS_TIMEOUT,
+        ping_interval=WS_PING_INTERVAL,  # keep-alive between captures
+        ping_timeout=WS_PING_TIMEOUT,
+        ssl=ssl_context
+    )
+
 async def send_image_and_receive_receipt(image_path, ws_server):
     """Send image to server and receive receipt."""
-    try:
-        print(f"🌐 Connecting to {ws_server}...")
-        
-        # Create SSL context that doesn't verify self-signed certificates
-        ssl_context = None
-        if ws_server.startswith('wss://'):
-            import ssl
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-        
-        async with websockets.connect(
-            ws_server,
-            max_size=15_000_000,
-            open_timeout=WS_TIMEOUT,
-            close_timeout=WS_TIMEOUT,
-            ssl=ssl_context
-        ) as ws:
-            # Read and send image
-            with open(image_path, "rb") as f:
-                image_data = f.read()
-            
-            await ws.send(base64.b64encode(image_data))
-            print("📤 Image sent to server")
-            
-            # Receive receipt
-            response = await ws.recv()
-            receipt_bytes = base64.b64decode(response)
-            
-            # Save receipt
-            os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            receipt_path = f"{OUTPUT_FOLDER}/receipt_{ts}.png"
-            
-            with open(receipt_path, "wb") as f:
-                f.write(receipt_bytes)
+    global ws_conn
+    async with ws_lock:
+        # One retry: a kept-alive connection may have been dropped meanwhile
+        for attempt in range(2):
+            try:
+                # Reuse the open connection, only handshake (TCP + TLS) when needed
+                if ws_conn is None:
+                    ws_conn = await ws_connect(ws_server)
+                
+                # Stream the raw image as one fragmented binary message (no
+                # base64 inflation, never the whole file in memory at once)
+                await ws_conn.send(iter_file_chunks(image_path))
+                print("📤 Image sent to server")
+                
+                # Receive receipt
+                # Server answers a binary message with raw receipt bytes
+                receipt_bytes = await asyncio.wait_for(ws_conn.recv(), WS_RECEIPT_TIMEOUT)
+                
+                # Save receipt
+                os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+                receipt_path = f"{OUTPUT_FOLDER}/receipt_{ts}.png"
+                
+                with open(receipt_path, "wb") as f:
+                    f.write(receipt_bytes)
+                
+                print(f"📥 Receipt received: {receipt_path}")
+                return receipt_path
             
-            print(f"📥 Receipt received: {receipt_path}")
-            return receipt_path
+            except websockets.exceptions.ConnectionClosed as e:
+                # Stale connection (server restarted / idle drop): reconnect once
+                print(f"⚠️ WebSocket closed: {e}")
+                ws_conn = None
             
-    except Exception as e:
-        print(f"❌ WebSocket error: {e}")
+            except Exception as e:
+                print(f"❌ WebSocket error: {e}")
+                await ws_close()
+                return None
         return None
 
-def send_to_server_sync(image_path, ws_server):
-    """Synchronous wrapper for WebSocket communication."""
-    return asyncio.run(send_image_and_receive_receipt(image_path, ws_server))
-
 # ==============================
 # PRINT FUNCTION
 # ==============================
@@ -410,35 +651,38 @@ def print_receipt(image_path):
     try:
         from escpos.printer import Usb
         from PIL import Image
+        import numpy as np
+        import cv2
         
         if not os.path.exists(image_path):
             print(f"❌ Receipt not found: {image_path}")
             return False
         
-        # Load and resize image
-        img = Image.open(image_path).convert('L')
+        # Decode straight to grayscale (no RGB intermediate)
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            print(f"❌ Could not decode receipt: {image_path}")
+            return False
+        h, w = img.shape
         
         # Scale to fit printer width while maintaining aspect ratio
-        if img.width > PRINTER_IMAGE_WIDTH:
-            ratio = PRINTER_IMAGE_WIDTH / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((PRINTER_IMAGE_WIDTH, new_height), Image.LANCZOS)
-        
-        # Center image on paper (576 pixel paper width)
-        padding_left = (PRINTER_PAPER_WIDTH - img.width) // 2
-        centered_img = Image.new('L', (PRINTER_PAPER_WIDTH, img.height), 255)
-        centered_img.paste(img, (padding_left, 0))
+        if w > PRINTER_IMAGE_WIDTH:
+            h = int(h * PRINTER_IMAGE_WIDTH / w)
+            w = PRINTER_IMAGE_WIDTH
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
         
-        # Save temp file
-        temp_path = "/tmp/print_receipt.bmp"
-        centered_img.save(temp_path)
+        # Center image on paper (576 pixel paper width), kept in memory
+        padding_left = (PRINTER_PAPER_WIDTH - w) // 2
+        canvas = np.full((h, PRINTER_PAPER_WIDTH), 255, dtype=np.uint8)
+        canvas[:, padding_left:padding_left + w] = img
+        centered_img = Image.fromarray(canvas, 'L')
         
         # Print via USB
         print(f"🖨️ Printing receipt via USB...")
         p = Usb(PRINTER_USB_VENDOR, PRINTER_USB_PRODUCT, 
                 in_ep=PRINTER_USB_IN_EP, out_ep=PRINTER_USB_OUT_EP)
         p._raw(b'\x1B\x40')  # Reset printer
-        p.image(temp_path, impl="bitImageRaster",
+        p.image(centered_img, impl="bitImageRaster",
                 high_density_vertical=True, high_density_horizontal=True)
         p.text("\n\n\n")
         p.cut()
@@ -453,11 +697,25 @@ def print_receipt(image_path):
         traceback.print_exc()
         return False
 
+# Single worker: printer jobs run one at a time, in capture order
+print_executor = ThreadPoolExecutor(max_workers=1)
+
+def print_and_notify(receipt_path):
+    """Print a receipt, then tell the server (for the browsers) it's done."""
+    if print_receipt(receipt_path):
+        notify_server('print_done')
+        print("✅ Printed!")
+    else:
+        print("❌ Print failed")
+
 # ==============================
 # FULL CAPTURE FLOW
 # ==============================
-def do_capture_flow(ws_server):
-    """Complete capture flow: stop stream → countdown → capture → send → print."""
+async def do_capture_flow(ws_server):
+    """Complete capture flow: stop stream → countdown → capture → send → print.
+    
+    Runs on the WebSocket loop; blocking steps go to the default executor.
+    """
     global capture_in_progress, preview_active
     
     if capture_in_progress:
@@ -465,39 +723,57 @@ def do_capture_flow(ws_server):
     
     capture_in_progress = True
     was_preview_active = preview_active
+    cam = None
+    loop = asyncio.get_running_loop()
     
     try:
         # 1. Stop stream if using rpicam (camera can only be used by one process)
         if USE_RPICAM and stream_process:
             print("⏸️ Pausing preview for capture...")
-            stop_stream_process()
-            time.sleep(0.5)  # Extra time for camera to release
+            await loop.run_in_executor(None, stop_stream_process)
+            await asyncio.sleep(0.5)  # Extra time for camera to release
         
-        # 2. Countdown with LED/buzzer
-        blink_countdown(COUNTDOWN_SECONDS)
+        # 2. Countdown with LED/buzzer (Picamera2 autofocuses meanwhile)
+        if USE_RPICAM:
+            cam = await loop.run_in_executor(None, open_picamera)
+        await loop.run_in_executor(None, blink_countdown, COUNTDOWN_SECONDS)
         
         # 3. Capture image
-        if not capture_image():
+        ok = await loop.run_in_executor(None, capture_image, cam)
+        if cam is not None:
+            await loop.run_in_executor(None, close_picamera, cam)  # libcamera teardown blocks
+            cam = None
+        if not ok:
             return False, "Capture failed"
         
-        # 4. Send to server and get receipt
-        receipt_path = send_to_server_sync(IMAGE_PATH, ws_server)
+        # 4. Send to server and get receipt (same loop, no extra hop)
+        receipt_path = await send_image_and_receive_receipt(IMAGE_PATH, ws_server)
         if not receipt_path:
             return False, "Failed to get receipt from server"
         
-        # 5. Print receipt
-        if not print_receipt(receipt_path):
-            return False, "Print failed"
+        # 5. Queue the print and finish (the printer works while the
+        # preview can already restart); print_done is sent once it's out
+        loop.run_in_executor(print_executor, print_and_notify, receipt_path)
         
-        # 6. Notify server that print is done
-        notify_server('print_done')
-        
-        return True, "Captured and printed!"
+        return True, "Captured, printing..."
         
     finally:
+        if cam is not None:
+            await loop.run_in_executor(None, close_picamera, cam)
         capture_in_progress = False
         # Note: Preview will need to be restarted by user clicking preview again
 
+def report_capture_result(future):
+    """Log the outcome of a do_capture_flow() run."""
+    try:
+        success, message = future.result()
+    except Exception as e:
+        success, message = False, f"Capture error: {e}"
+    if success:
+        print(f"✅ {message}")
+    else:
+        print(f"❌ {message}")
+
 # ==============================
 # HTTP ENDPOINTS
 # ==============================
@@ -548,16 +824,10 @@ def capture():
     if capture_in_progress:
         return jsonify({"success": False, "error": "Capture in progress"}), 429
     
-    # Run capture in background thread
-    def capture_thread():
-        success, message = do_capture_flow(app.config['WS_SERVER'])
-        if success:
-            print(f"✅ {message}")
-        else:
-            print(f"❌ {message}")
-    
-    thread = threading.Thread(target=capture_thread, daemon=True)
-    thread.start()
+    # Run capture as a task on the background event loop
+    start_ws_loop()
+    future = asyncio.run_coroutine_threadsafe(do_capture_flow(app.config['WS_SERVER']), ws_loop)
+    future.add_done_callback(report_capture_result)
     
     return jsonify({"success": True, "message": "Capture started"})
 
@@ -578,6 +848,7 @@ def main():
         ws_server_url = "ws://localhost:8765"
     
     app.config['WS_SERVER'] = ws_server_url
+    start_ws_loop()
     
     # Get local IP
     try:
@@ -608,7 +879,18 @@ def main():
     print(f"  POST /capture        - Capture with countdown")
     print()
     
-    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+    # Advertise over mDNS (no-op without zeroconf)
+    if DISCOVERY_AVAILABLE:
+        registration = PotboyServiceRegistration(
+            CLIENT_SERVICE_NAME, args.port,
+            {'device': socket.gethostname(), 'role': 'camera'})
+        if registration.start():
+            atexit.register(registration.stop)
+    
+    if WAITRESS_AVAILABLE:
+        serve(app, host='0.0.0.0', port=args.port, threads=HTTP_THREADS)
+    else:
+        app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,22 +7,48 @@ Uses mDNS/Zeroconf to automatically discover the server on the local network.
 - No manual IP configuration needed!
 
 Requirements:
-    pip install zeroconf
+    pip install "zeroconf>=0.132"
 """
 
+import os
+import json
 import socket
 import time
+import atexit
 import threading
 from typing import Optional, Callable
 
 # Try to import zeroconf, gracefully degrade if not available
 try:
     from zeroconf import ServiceBrowser, ServiceInfo, Zeroconf, ServiceStateChange
+    from zeroconf import __version__ as ZEROCONF_VERSION
     ZEROCONF_AVAILABLE = True
 except ImportError:
     ZEROCONF_AVAILABLE = False
     print("⚠️ zeroconf not installed. Auto-discovery disabled.")
-    print("   Install with: pip install zeroconf")
+    print('   Install with: pip install "zeroconf>=0.132"')
+
+# 0.132 brought the faster ServiceBrowser scheduler and packet handling
+ZEROCONF_MIN_VERSION = (0, 132)
+
+if ZEROCONF_AVAILABLE:
+    try:
+        zc_version = tuple(int(x) for x in ZEROCONF_VERSION.split('.')[:2])
+    except ValueError:
+        zc_version = ZEROCONF_MIN_VERSION  # Dev/odd version string: trust it
+    if zc_version < ZEROCONF_MIN_VERSION:
+        ZEROCONF_AVAILABLE = False
+        print(f"⚠️ zeroconf {ZEROCONF_VERSION} is too old (need >= 0.132). Auto-discovery disabled.")
+        print('   Upgrade with: pip install --upgrade "zeroconf>=0.132"')
+    else:
+        # Wheels ship Cython-compiled modules; a pure-Python install is much slower
+        try:
+            from zeroconf import _dns
+            if not _dns.__file__.endswith(('.so', '.pyd')):
+                print("⚠️ zeroconf C extension not found (slow pure-Python mode).")
+                print('   Reinstall with: pip install --upgrade --force-reinstall "zeroconf>=0.132"')
+        except (ImportError, AttributeError, TypeError):
+            pass
 
 
 # Service type for Potboy
@@ -30,17 +56,122 @@ SERVICE_TYPE = "_potboy._tcp.local."
 SERVER_SERVICE_NAME = "potboy-server._potboy._tcp.local."
 CLIENT_SERVICE_NAME = "potboy-client._potboy._tcp.local."
 
+# Last discovered server, reused across runs while it still answers
+SERVER_CACHE_PATH = os.path.expanduser("~/.potboy/server.json")
+SERVER_CACHE_TTL = 300  # seconds
+
+# One Zeroconf (multicast sockets + engine thread) per process, shared by
+# registration and discovery
+_shared_zc = None
+_shared_zc_lock = threading.Lock()
+
+
+def get_shared_zeroconf() -> "Zeroconf":
+    """Return the process-wide Zeroconf instance, creating it on first use."""
+    global _shared_zc
+    with _shared_zc_lock:
+        if _shared_zc is None:
+            _shared_zc = Zeroconf()
+            atexit.register(close_shared_zeroconf)
+        return _shared_zc
+
+
+def close_shared_zeroconf():
+    """Close the shared Zeroconf instance (runs at exit)."""
+    global _shared_zc
+    with _shared_zc_lock:
+        if _shared_zc is not None:
+            try:
+                _shared_zc.close()
+            except Exception:
+                pass
+            _shared_zc = None
+
+
+# Services seen by any discovery in this process: name -> (ip, port, properties).
+# Validity is checked against the shared Zeroconf's record cache, so entries
+# expire with the normal mDNS TTLs.
+_service_cache: dict = {}
+_service_cache_lock = threading.Lock()
 
-def get_local_ip() -> str:
-    """Get the local IP address of this machine."""
+
+def _remember_service(name: str, entry: tuple):
+    with _service_cache_lock:
+        _service_cache[name] = entry
+
+
+def _forget_service(name: str):
+    with _service_cache_lock:
+        _service_cache.pop(name, None)
+
+
+def _cached_service(name: str) -> Optional[tuple]:
+    """Return a remembered service if its records are still in the mDNS cache."""
+    with _service_cache_lock:
+        if name not in _service_cache:
+            return None
+    info = ServiceInfo(SERVICE_TYPE, name)
+    if info.load_from_cache(get_shared_zeroconf()) and info.addresses:
+        entry = (socket.inet_ntoa(info.addresses[0]), info.port, _service_properties(info))
+        _remember_service(name, entry)
+        return entry
+    _forget_service(name)
+    return None
+
+
+_cached_local_ip: Optional[str] = None
+
+
+def get_local_ip(refresh: bool = False) -> str:
+    """Get the local IP address of this machine (cached after the first call)."""
+    global _cached_local_ip
+    if _cached_local_ip and not refresh:
+        return _cached_local_ip
     try:
+        # UDP connect sends nothing, it just picks the default-route source IP
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
+        _cached_local_ip = ip
         return ip
     except Exception:
-        return "127.0.0.1"
+        return "127.0.0.1"  # Not cached: retry once the network is up
+
+
+def _service_properties(info) -> dict:
+    """TXT properties of a ServiceInfo as a str dict."""
+    # zeroconf >= 0.132 decodes (and caches) these itself
+    properties = getattr(info, 'decoded_properties', None)
+    if properties is None:
+        properties = {k.decode() if isinstance(k, bytes) else k: 
+                     v.decode() if isinstance(v, bytes) else v 
+                     for k, v in info.properties.items()}
+    return properties
+
+
+def resolve_known_service(name: str, type_: str = SERVICE_TYPE,
+                          timeout_ms: int = 3000) -> Optional[tuple]:
+    """
+    Resolve a service whose full name is already known (no browsing).
+    
+    Sends the SRV/TXT/A queries for that one name instead of running a
+    ServiceBrowser, so a present service answers in a single round trip.
+    
+    Returns:
+        (ip, port, properties) tuple if resolved, None otherwise
+    """
+    if not ZEROCONF_AVAILABLE:
+        return None
+    
+    # request() answers from the record cache when it can, else queries
+    info = ServiceInfo(type_, name)
+    if not info.request(get_shared_zeroconf(), timeout_ms) or not info.addresses:
+        return None
+    entry = (socket.inet_ntoa(info.addresses[0]), info.port, _service_properties(info))
+    if type_ == SERVICE_TYPE:
+        _remember_service(name, entry)
+    return entry
 
 
 class PotboyServiceRegistration:
@@ -61,7 +192,7 @@ class PotboyServiceRegistration:
         try:
             local_ip = get_local_ip()
             
-            self.zeroconf = Zeroconf()
+            self.zeroconf = get_shared_zeroconf()
             self.info = ServiceInfo(
                 SERVICE_TYPE,
                 self.service_name,
@@ -83,8 +214,8 @@ class PotboyServiceRegistration:
         """Stop advertising the service."""
         if self.zeroconf and self.info:
             try:
+                # Shared instance stays open for other users
                 self.zeroconf.unregister_service(self.info)
-                self.zeroconf.close()
                 print(f"📡 Service unregistered: {self.service_name}")
             except:
                 pass
@@ -105,6 +236,7 @@ class PotboyServiceDiscovery:
         self.browser: Optional[ServiceBrowser] = None
         self._on_found: Optional[Callable] = None
         self._lock = threading.Lock()
+        self._found_event = threading.Event()  # Set when the target shows up
     
     def _on_service_state_change(self, zeroconf: Zeroconf, service_type: str, 
                                   name: str, state_change: ServiceStateChange):
@@ -116,12 +248,13 @@ class PotboyServiceDiscovery:
                 if info.addresses:
                     ip = socket.inet_ntoa(info.addresses[0])
                     port = info.port
-                    properties = {k.decode() if isinstance(k, bytes) else k: 
-                                 v.decode() if isinstance(v, bytes) else v 
-                                 for k, v in info.properties.items()}
+                    properties = _service_properties(info)
                     
                     with self._lock:
                         self.discovered_services[name] = (ip, port, properties)
+                    _remember_service(name, (ip, port, properties))
+                    if self.target_service is None or name == self.target_service:
+                        self._found_event.set()
                     
                     print(f"🔍 Discovered: {name} at {ip}:{port}")
                     
@@ -129,6 +262,7 @@ class PotboyServiceDiscovery:
                         self._on_found(name, ip, port, properties)
         
         elif state_change == ServiceStateChange.Removed:
+            _forget_service(name)
             with self._lock:
                 if name in self.discovered_services:
                     del self.discovered_services[name]
@@ -149,7 +283,7 @@ class PotboyServiceDiscovery:
         
         try:
             self._on_found = on_found
-            self.zeroconf = Zeroconf()
+            self.zeroconf = get_shared_zeroconf()
             self.browser = ServiceBrowser(
                 self.zeroconf, 
                 SERVICE_TYPE, 
@@ -175,23 +309,41 @@ class PotboyServiceDiscovery:
         if not ZEROCONF_AVAILABLE:
             return None
         
+        # Seen earlier in this process and still cached: no need to wait
+        if self.target_service:
+            candidates = [self.target_service]
+        else:
+            with _service_cache_lock:
+                candidates = list(_service_cache)
+        for name in candidates:
+            cached = _cached_service(name)
+            if cached:
+                with self._lock:
+                    self.discovered_services[name] = cached
+                return cached
+        
         if not self.zeroconf:
             self.start()
         
-        # Wait for service to be discovered
-        start_time = time.time()
-        while time.time() - start_time < timeout:
+        # Wait for the browser callback to report the service. Monotonic
+        # deadline: immune to the clock jump when NTP syncs after boot
+        deadline = time.monotonic() + timeout
+        while True:
             with self._lock:
-                if self.target_service and self.target_service in self.discovered_services:
-                    return self.discovered_services[self.target_service]
-                
-                # If no specific target, return first found
-                if not self.target_service and self.discovered_services:
-                    return list(self.discovered_services.values())[0]
+                if self.target_service:
+                    result = self.discovered_services.get(self.target_service)
+                elif self.discovered_services:
+                    # If no specific target, return first found
+                    result = next(iter(self.discovered_services.values()))
+                else:
+                    result = None
+                if result is None:
+                    self._found_event.clear()  # Stale (service was removed)
             
-            time.sleep(0.2)
-        
-        return None
+            remaining = deadline - time.monotonic()
+            if result is not None or remaining <= 0:
+                return result
+            self._found_event.wait(remaining)
     
     def get_server(self) -> Optional[tuple]:
         """Get cached server info without waiting."""
@@ -206,31 +358,79 @@ class PotboyServiceDiscovery:
     
     def stop(self):
         """Stop discovering services."""
-        if self.zeroconf:
+        if self.browser:
             try:
-                self.zeroconf.close()
+                # Shared instance stays open for other users
+                self.browser.cancel()
             except:
                 pass
+            self.browser = None
 
 
-def discover_server(timeout: float = 10.0) -> Optional[str]:
+def _load_cached_server() -> Optional[tuple]:
+    """Return (ip, port) from the server cache if it is younger than the TTL."""
+    try:
+        if time.time() - os.path.getmtime(SERVER_CACHE_PATH) > SERVER_CACHE_TTL:
+            return None
+        with open(SERVER_CACHE_PATH) as f:
+            data = json.load(f)
+        return data["ip"], int(data["port"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_cached_server(ip: str, port: int):
+    """Write the server cache atomically (errors are ignored)."""
+    try:
+        os.makedirs(os.path.dirname(SERVER_CACHE_PATH), exist_ok=True)
+        tmp_path = SERVER_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ip": ip, "port": port}, f)
+        os.replace(tmp_path, SERVER_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def _server_reachable(ip: str, port: int, timeout: float = 0.5) -> bool:
+    """Single TCP connect to check a cached server is still there."""
+    try:
+        with socket.create_connection((ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def discover_server(timeout: float = 10.0, force_refresh: bool = False) -> Optional[str]:
     """
     Convenience function to discover the Potboy server.
     
+    Args:
+        timeout: Maximum mDNS wait in seconds
+        force_refresh: Skip the on-disk cache and always run mDNS
+    
     Returns:
         WebSocket URL (ws://ip:port) if found, None otherwise
     """
+    if not force_refresh:
+        cached = _load_cached_server()
+        if cached and _server_reachable(*cached):
+            ws_url = f"ws://{cached[0]}:{cached[1]}"
+            print(f"✅ Server (cached): {ws_url}")
+            return ws_url
+    
     if not ZEROCONF_AVAILABLE:
         return None
     
     print(f"🔍 Searching for Potboy server ({timeout}s timeout)...")
     
-    discovery = PotboyServiceDiscovery(SERVER_SERVICE_NAME)
-    result = discovery.find_service(timeout)
-    discovery.stop()
+    # The server's name is fixed, so resolve it directly (browsing is for
+    # finding unknown services)
+    result = resolve_known_service(SERVER_SERVICE_NAME, timeout_ms=int(timeout * 1000))
     
     if result:
         ip, port, _ = result
+        print(f"🔍 Discovered: {SERVER_SERVICE_NAME} at {ip}:{port}")
+        _save_cached_server(ip, port)
         ws_url = f"ws://{ip}:{port}"
         print(f"✅ Server found: {ws_url}")
         return ws_url
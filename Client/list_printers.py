@@ -1,22 +1,41 @@
-import win32print
+class Tee:
+    """
+    Minimal stdout stand-in that writes to several streams at once.
+    """
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, s):
+        for stream in self.streams:
+            stream.write(s)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
 
 
 def list_printers():
     """
     Lists all installed printers on the Windows system.
     """
+    # Imported here so the module still loads on Linux (the Pi)
+    try:
+        import win32print
+    except ImportError:
+        print("win32print not available (Windows only). Install with: pip install pywin32")
+        return
+
     try:
         # PRINTER_ENUM_LOCAL: Enumerates local printers.
         # PRINTER_ENUM_CONNECTIONS: Enumerates network connections.
         flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
-        printers = win32print.EnumPrinters(flags)
+        # Level 4 (PRINTER_INFO_4) only carries the name/server/attributes
+        printers = win32print.EnumPrinters(flags, None, 4)
 
         print(f"Found {len(printers)} printers:")
         print("-" * 40)
         for printer in printers:
-            # printer structure: (flags, description, name, comment)
-            # We usually just want the name (index 2)
-            printer_name = printer[2]
+            printer_name = printer['pPrinterName']
             print(f" - {printer_name}")
         print("-" * 40)
         print("\nUse the exact name above in your print scripts.")
@@ -29,13 +48,12 @@ def list_printers():
 
 
 if __name__ == "__main__":
-    # Redirect output to file to ensure we capture it
+    # Enumerate once, writing to both the console and the file
     import sys
     original_stdout = sys.stdout
     with open("printers_list.txt", "w", encoding="utf-8") as f:
-        sys.stdout = f
-        list_printers()
-        sys.stdout = original_stdout
-
-    # Also print to console
-    list_printers()
+        sys.stdout = Tee(original_stdout, f)
+        try:
+            list_printers()
+        finally:
+            sys.stdout = original_stdout
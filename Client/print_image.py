@@ -1,5 +1,11 @@
 from escpos.printer import File
+from PIL import Image
+import numpy as np
+import atexit
+import errno
+import os
 import sys
+import threading
 
 # ==========================================
 # CONFIGURATION
@@ -14,12 +20,152 @@ IMAGE_PATH = "image.jpg"
 # Printer width in pixels (80mm = 576, 58mm = 384)
 PRINTER_WIDTH = 576
 
+# Rows per GS v 0 block (same split as python-escpos)
+RASTER_FRAGMENT_ROWS = 960
+
+# Raw ESC/POS commands around the raster
+ESC_INIT = b'\x1B\x40'   # ESC @ - Initialize
+FEED_LINES = b'\n\n\n'
+FEED_AND_CUT = b'\x1Bd\x06' + b'\x1DV\x00'  # ESC d 6 (feed to cutter), GS V 0 (full cut)
+
 # ==========================================
 
+# Printer device stays open between jobs (reopened if the printer went away)
+lp_fd = None
+lp_lock = threading.Lock()
+
+
+def close_printer():
+    global lp_fd
+    if lp_fd is not None:
+        try:
+            os.close(lp_fd)
+        except OSError:
+            pass
+        lp_fd = None
+
+
+atexit.register(close_printer)
+
+
+def writev_all(fd, views):
+    """
+    os.writev until every byte is written (writev may stop short).
+    views is a list of memoryviews, consumed in place: if a write fails,
+    it holds exactly what was not sent yet.
+    """
+    while views:
+        n = os.writev(fd, views)
+        if n == 0:
+            raise OSError(errno.EIO, "printer accepted no data")
+        # Drop what was written, keep the rest for the next call
+        while n:
+            if n >= len(views[0]):
+                n -= len(views.pop(0))
+            else:
+                views[0] = views[0][n:]
+                n = 0
+
+
+def write_to_printer(chunks):
+    """
+    Writes the chunks to the printer in one writev, reusing the open device.
+    Reopens and retries once if the printer was unplugged or power-cycled,
+    but only if none of the job had gone out yet (a resend would tear it).
+    """
+    global lp_fd
+    views = [memoryview(c) for c in chunks if len(c)]
+    total = sum(len(v) for v in views)
+    with lp_lock:
+        for attempt in range(2):
+            if lp_fd is None:
+                lp_fd = os.open(PRINTER_DEVICE, os.O_WRONLY | os.O_CLOEXEC)
+            try:
+                writev_all(lp_fd, views)
+                return
+            except OSError as e:
+                close_printer()
+                nothing_sent = sum(len(v) for v in views) == total
+                if e.errno not in (errno.EIO, errno.ENODEV) or attempt or not nothing_sent:
+                    raise
+
+
+def load_image(image_path, width=PRINTER_WIDTH):
+    """
+    Loads an image as grayscale, no wider than the paper.
+    """
+    img = Image.open(image_path)
+
+    if img.width > width:
+        # JPEG: let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+        # (never below the target size), so big photos aren't decoded in full
+        img.draft('L', (width, img.height * width // img.width))
+
+    # Transparent pixels are usually black underneath: put them on white
+    # paper first, like escpos does (convert('L') would just drop alpha)
+    if 'A' in img.getbands() or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    img = img.convert('L')
+
+    # Shrink to the paper width if needed
+    if img.width > width:
+        img = img.resize((width, img.height * width // img.width), Image.LANCZOS)
+    return img
+
+
+def raster_from_path(image_path, width=PRINTER_WIDTH):
+    """
+    Converts an image to ESC/POS GS v 0 raster commands, centered on the paper.
+    Same output as escpos' bitImageRaster, but packed with NumPy.
+    """
+    img = load_image(image_path, width)
+
+    # Center on a white canvas as wide as the paper
+    h = img.height
+    canvas = np.full((h, width), 255, dtype=np.uint8)
+    left = (width - img.width) // 2
+    canvas[:, left:left + img.width] = np.asarray(img)
+
+    # Dither to 1-bit like escpos does, then pack 8 dots per byte (1 = black)
+    dots = np.asarray(Image.fromarray(canvas, 'L').convert('1')) == 0
+    packed = np.packbits(dots, axis=1)
+    row_bytes = packed.shape[1]
+
+    out = bytearray()
+    for y in range(0, h, RASTER_FRAGMENT_ROWS):
+        block = packed[y:y + RASTER_FRAGMENT_ROWS]
+        out += b'\x1Dv0\x00'  # GS v 0, normal (high) density
+        out += row_bytes.to_bytes(2, 'little') + len(block).to_bytes(2, 'little')
+        out += block.tobytes()
+    return bytes(out)
+
+
+def print_image(image_path, legacy=False):
+    """
+    Prints an image to the thermal printer.
+    The whole job goes out in one write; legacy=True uses python-escpos instead.
+    """
+    if legacy:
+        return print_image_escpos(image_path)
+
+    try:
+        raster = raster_from_path(image_path)
+
+        # One gathered write: init + image + feed + cut
+        write_to_printer([ESC_INIT, raster, FEED_LINES, FEED_AND_CUT])
+
+        print(f"Successfully printed image to {PRINTER_DEVICE}!")
+
+    except Exception as e:
+        print_error(e)
+
 
-def print_image(image_path):
+def print_image_escpos(image_path):
     """
-    Prints an image to the thermal printer using python-escpos.
+    Prints an image to the thermal printer using python-escpos (old path).
     """
     try:
         # Connect to the printer via file device
@@ -29,9 +175,8 @@ def print_image(image_path):
         p._raw(b'\x1B\x40')  # ESC @ - Initialize
 
         # Print the image - escpos handles all the conversion automatically!
-        # impl parameter can be: 'bitImageRaster', 'graphics', or 'bitImageColumn'
         # center=True will center based on PRINTER_WIDTH
-        p.image(image_path, impl='bitImageRaster', high_density_vertical=True, high_density_horizontal=True, center=True)
+        p.image(load_image(image_path), impl='bitImageRaster', high_density_vertical=True, high_density_horizontal=True, center=True)
 
         # Feed and cut
         p.text("\n\n\n")
@@ -43,19 +188,28 @@ def print_image(image_path):
         print(f"Successfully printed image to {PRINTER_DEVICE}!")
 
     except Exception as e:
-        print(f"Error printing image:")
-        print(e)
-        print("\nTroubleshooting:")
-        print("1. Check if device exists: ls -la /dev/usb/lp0")
-        print("2. Add permissions: sudo usermod -a -G lp $USER && sudo reboot")
-        print("3. Try running with sudo: sudo python3 print_image.py")
-        print("4. Try different 'impl' values: 'bitImageRaster', 'graphics', 'bitImageColumn'")
+        print_error(e)
+
+
+def print_error(e):
+    """
+    Prints the error with troubleshooting hints.
+    """
+    print(f"Error printing image:")
+    print(e)
+    print("\nTroubleshooting:")
+    print("1. Check if device exists: ls -la /dev/usb/lp0")
+    print("2. Add permissions: sudo usermod -a -G lp $USER && sudo reboot")
+    print("3. Try running with sudo: sudo python3 print_image.py")
+    print("4. Try the python-escpos path: python3 print_image.py image.jpg --legacy")
 
 
 if __name__ == "__main__":
-    # Allow passing image path as argument
-    target_image = sys.argv[1] if len(sys.argv) > 1 else IMAGE_PATH
+    # Allow passing image path as argument (--legacy prints via python-escpos)
+    args = [a for a in sys.argv[1:] if a != '--legacy']
+    legacy = '--legacy' in sys.argv[1:]
+    target_image = args[0] if args else IMAGE_PATH
 
     print(f"Attempting to print image to {PRINTER_DEVICE}...")
     print(f"Image: {target_image}")
-    print_image(target_image)
+    print_image(target_image, legacy=legacy)
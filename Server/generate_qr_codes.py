@@ -10,6 +10,7 @@ This will create a 'qr_codes' folder with:
 """
 
 import os
+import multiprocessing
 import qrcode
 from PIL import Image, ImageDraw, ImageFont
 
@@ -28,33 +29,51 @@ QR_SIZE = 300
 
 # ==========================================
 
+# Label font, loaded once per process (see load_label_font)
+label_font = None
+
+
+def load_label_font():
+    """Load the label font (also used as the worker pool initializer)."""
+    global label_font
+    try:
+        label_font = ImageFont.truetype("arial.ttf", 14)
+    except:
+        label_font = ImageFont.load_default()
+
 
 def generate_qr_code(content, filename, output_folder):
-    """Generate a QR code image for the given content."""
+    """Generate a QR code image for the given content.
+    
+    Returns (output_path, image) so callers can reuse the image in memory.
+    """
+    border = 2
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=10,
-        border=2,
+        border=border,
     )
     qr.add_data(content)
     qr.make(fit=True)
     
-    # Create QR image
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    qr_img = qr_img.resize((QR_SIZE, QR_SIZE), Image.LANCZOS)
+    # Pick the largest whole-pixel module size that fits QR_SIZE, so the
+    # code comes out sharp at its native size (no resampling)
+    qr.box_size = max(1, QR_SIZE // (qr.modules_count + 2 * border))
+    # convert() goes through qrcode's PIL wrapper to a plain PIL image (the
+    # same delegation the old resize() call relied on, works on any version)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+    offset = (QR_SIZE - qr_img.size[0]) // 2
     
     # Add label below QR code
     label_height = 40
     final_img = Image.new('RGB', (QR_SIZE, QR_SIZE + label_height), 'white')
-    final_img.paste(qr_img, (0, 0))
+    final_img.paste(qr_img, (offset, offset))
     
     # Draw label
     draw = ImageDraw.Draw(final_img)
-    try:
-        font = ImageFont.truetype("arial.ttf", 14)
-    except:
-        font = ImageFont.load_default()
+    if label_font is None:
+        load_label_font()
+    font = label_font
     
     # Center the text
     text = content[:30] + "..." if len(content) > 30 else content
@@ -66,7 +85,7 @@ def generate_qr_code(content, filename, output_folder):
     # Save
     output_path = os.path.join(output_folder, f"qr_{filename}.png")
     final_img.save(output_path)
-    return output_path
+    return output_path, final_img
 
 
 def create_qr_sheet(qr_images, output_folder):
@@ -86,14 +105,14 @@ def create_qr_sheet(qr_images, output_folder):
     
     sheet = Image.new('RGB', (sheet_width, sheet_height), 'white')
     
-    for i, (qr_path, label) in enumerate(qr_images):
+    for i, (qr_img, label) in enumerate(qr_images):
         row = i // cols
         col = i % cols
         
         x = 20 + col * cell_width
         y = 20 + row * cell_height
         
-        qr_img = Image.open(qr_path)
+        # Already in memory, no need to re-read the PNG
         sheet.paste(qr_img, (x, y))
     
     sheet_path = os.path.join(output_folder, "qr_sheet.png")
@@ -127,10 +146,13 @@ def main():
     
     qr_images = []
     
-    for img_name in images:
-        # QR code contains just the filename
-        qr_path = generate_qr_code(img_name, img_name, output_folder)
-        qr_images.append((qr_path, img_name))
+    # QR code contains just the filename; one worker per core
+    jobs = [(img_name, img_name, output_folder) for img_name in images]
+    with multiprocessing.Pool(os.cpu_count(), initializer=load_label_font) as pool:
+        results = pool.starmap(generate_qr_code, jobs)
+    
+    for img_name, (qr_path, qr_img) in zip(images, results):
+        qr_images.append((qr_img, img_name))
         print(f"  ✅ {img_name} -> qr_{img_name}.png")
     
     # Create printable sheet
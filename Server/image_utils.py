@@ -0,0 +1,11 @@
+"""
+Image helpers shared by main_server.py and main_server2.py
+"""
+
+# JPEG, PNG, GIF
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF8')
+
+
+def is_valid_image(data):
+    """True if data starts with a known image file signature."""
+    return len(data) >= 8 and data.startswith(IMAGE_SIGNATURES)
@@ -16,9 +16,10 @@ import ssl
 import os
 import socket
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from receipt_generator import make_receipt
+from image_utils import is_valid_image
 import aiohttp
 
 # Load environment variables
@@ -33,6 +34,9 @@ QR_SERVER_PORT = int(os.getenv('QR_SERVER_PORT', 5000))
 RASPBERRY_PI_IP = os.getenv('RASPBERRY_PI_IP', '100.102.29.90')
 RASPBERRY_PI_PORT = int(os.getenv('RASPBERRY_PI_PORT', 5001))
 
+# Self-signed certificate is renewed when it has less than this left
+SSL_RENEW_BEFORE = timedelta(days=14)
+
 # ==========================================
 # CONNECTED CLIENTS
 # ==========================================
@@ -54,41 +58,60 @@ def get_local_ip():
         return "localhost"
 
 
-def is_valid_image(data):
-    if len(data) < 8:
-        return False
-    if data[:3] == b'\xff\xd8\xff':
-        return True
-    if data[:8] == b'\x89PNG\r\n\x1a\n':
-        return True
-    if data[:4] == b'GIF8':
-        return True
-    return False
+BASE64_CHARS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+
+
+def looks_like_base64(data):
+    """Cheap check before attempting a full-payload base64 decode."""
+    return len(data) > 0 and len(data) % 4 == 0 and data[0] in BASE64_CHARS
+
+
+def decode_base64_image(data):
+    try:
+        decoded = base64.b64decode(data, validate=True)
+    except ValueError:  # binascii.Error
+        return None
+    return decoded if is_valid_image(decoded) else None
 
 
 def decode_image_data(data):
     if isinstance(data, str):
         try:
-            decoded = base64.b64decode(data)
-            if is_valid_image(decoded):
-                return decoded
-        except:
-            pass
-        return None
+            data = data.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        return decode_base64_image(data) if looks_like_base64(data) else None
     
     if isinstance(data, bytes):
         if is_valid_image(data):
             return data
-        try:
-            decoded = base64.b64decode(data)
-            if is_valid_image(decoded):
-                return decoded
-        except:
-            pass
+        if looks_like_base64(data):
+            return decode_base64_image(data)
     
     return None
 
 
+def write_temp_file(path, data, mode=0o644):
+    """Write data next to path (as path.tmp), returns the temp path."""
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return tmp_path
+
+
+def cert_expires_soon(crypto, cert_file):
+    """True if the certificate can't be read or is close to expiring."""
+    try:
+        with open(cert_file, "rb") as f:
+            cert = crypto.load_certificate(crypto.FILETYPE_PEM, f.read())
+        not_after = datetime.strptime(cert.get_notAfter().decode(), "%Y%m%d%H%M%SZ")
+        not_after = not_after.replace(tzinfo=timezone.utc)
+        return not_after - datetime.now(timezone.utc) < SSL_RENEW_BEFORE
+    except Exception:
+        return True
+
+
 def generate_ssl_context():
     """Generate self-signed SSL certificate for HTTPS."""
     try:
@@ -97,10 +120,16 @@ def generate_ssl_context():
         cert_file = "server.crt"
         key_file = "server.key"
         
-        if os.path.exists(cert_file) and os.path.exists(key_file):
+        # Reuse the existing certificate until it's about to expire
+        if (os.path.exists(cert_file) and os.path.exists(key_file)
+                and not cert_expires_soon(crypto, cert_file)):
             ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            ctx.load_cert_chain(cert_file, key_file)
-            return ctx
+            try:
+                ctx.load_cert_chain(cert_file, key_file)
+                return ctx
+            except ssl.SSLError as e:
+                # e.g. key and cert don't match: make a fresh pair
+                print(f"⚠️ Existing certificate unusable ({e}), regenerating")
         
         print("Generating SSL certificate...")
         
@@ -116,10 +145,13 @@ def generate_ssl_context():
         cert.set_pubkey(k)
         cert.sign(k, 'sha256')
         
-        with open(cert_file, "wb") as f:
-            f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
-        with open(key_file, "wb") as f:
-            f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, k))
+        # Write both files in full before swapping either in, so the window
+        # for a mismatched pair is just two renames (and a mismatched pair is
+        # regenerated on the next start, see above)
+        key_tmp = write_temp_file(key_file, crypto.dump_privatekey(crypto.FILETYPE_PEM, k), 0o600)
+        cert_tmp = write_temp_file(cert_file, crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+        os.replace(key_tmp, key_file)
+        os.replace(cert_tmp, cert_file)
         
         ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ctx.load_cert_chain(cert_file, key_file)
@@ -134,6 +166,13 @@ def generate_ssl_context():
 # WEBSOCKET HANDLER
 # ==========================================
 
+def save_bytes(folder, name, data):
+    """Blocking file write, run via asyncio.to_thread."""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), "wb") as f:
+        f.write(data)
+
+
 async def websocket_handler(ws):
     print("📡 Raspberry Pi connected")
     connected_clients.add(ws)
@@ -148,36 +187,39 @@ async def websocket_handler(ws):
             
             print(f"📥 Image received ({len(data)} bytes)")
             
+            # Clients sending raw binary frames get a binary reply,
+            # legacy clients still get base64
+            binary_client = isinstance(data, bytes) and is_valid_image(data)
+            
             photo_bytes = decode_image_data(data)
             if photo_bytes is None:
                 print("❌ Invalid image data")
                 continue
             
-            # Save image
-            os.makedirs("received_images", exist_ok=True)
+            # Save image (off the event loop, other clients keep being served)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             photo_name = f"{timestamp}.jpg"
-            with open(f"received_images/{photo_name}", "wb") as f:
-                f.write(photo_bytes)
+            await asyncio.to_thread(save_bytes, "received_images", photo_name, photo_bytes)
             print(f"💾 Saved: received_images/{photo_name}")
             
-            # Generate receipt
+            # Generate receipt (PIL work in a thread, the loop keeps serving)
             try:
-                receipt_bytes = make_receipt(photo_bytes)
+                receipt_bytes = await asyncio.to_thread(make_receipt, photo_bytes)
                 print("🧾 Receipt generated")
             except Exception as e:
                 print(f"❌ Receipt error: {e}")
                 continue
             
             # Save receipt
-            os.makedirs("output", exist_ok=True)
             receipt_name = f"receipt_{timestamp}.jpg"
-            with open(f"output/{receipt_name}", "wb") as f:
-                f.write(receipt_bytes)
+            await asyncio.to_thread(save_bytes, "output", receipt_name, receipt_bytes)
             print(f"💾 Saved: output/{receipt_name}")
             
             # Send back to Raspberry Pi
-            await ws.send(base64.b64encode(receipt_bytes))
+            if binary_client:
+                await ws.send(receipt_bytes)
+            else:
+                await ws.send(base64.b64encode(receipt_bytes))
             print("📤 Receipt sent to Raspberry Pi\n")
             
     except websockets.exceptions.ConnectionClosed:
@@ -24,6 +24,7 @@ import logging
 from datetime import datetime
 from dotenv import load_dotenv
 import aiohttp
+from image_utils import is_valid_image
 
 # Suppress noisy websockets logs
 logging.getLogger('websockets').setLevel(logging.ERROR)
@@ -739,11 +740,16 @@ async def websocket_handler(ws):
                 except json.JSONDecodeError:
                     pass
             
-            # Assume it's image data (base64 encoded)
+            # Image data: raw bytes in a binary frame, or base64 (legacy clients)
             print(f"📥 Image received ({len(message)} bytes)")
             
             try:
-                if isinstance(message, str):
+                # Raw binary clients get a raw binary reply
+                binary_client = isinstance(message, bytes) and is_valid_image(message)
+                
+                if binary_client:
+                    photo_bytes = message
+                elif isinstance(message, str):
                     photo_bytes = base64.b64decode(message)
                 else:
                     photo_bytes = base64.b64decode(message.decode())
@@ -765,8 +771,11 @@ async def websocket_handler(ws):
                     f.write(receipt_bytes)
                 print(f"💾 Saved: output/receipt_{timestamp}.jpg")
                 
-                # Send back to Pi
-                await ws.send(base64.b64encode(receipt_bytes))
+                # Send back to Pi (in the encoding it used)
+                if binary_client:
+                    await ws.send(receipt_bytes)
+                else:
+                    await ws.send(base64.b64encode(receipt_bytes))
                 print("📤 Receipt sent to Raspberry Pi")
                 
                 # Notify browsers